@@ -0,0 +1,69 @@
+"""
+Compares picking the chosen names with name_slices() against the original
+df[df["name"].isin(chosen_value)] scan, on made up daily means of 1k, 100k
+and 10M rows.
+
+Run from the Chapter-4 folder:
+    python benchmark_filter.py
+"""
+import timeit
+
+import numpy as np
+import pandas as pd
+
+from ingest_tweets import name_slices
+
+
+def synthetic_daily(rows, seed=0):
+    """daily means like load_daily() returns, sorted by name and then date.
+    Up to 10,000 days (27 years) of each name, with more names for more rows.
+    """
+    rng = np.random.default_rng(seed)
+    names = max(10, rows // 10_000)
+    days = rows // names
+    return pd.DataFrame(
+        {
+            "date_time": np.tile(
+                pd.date_range("2010-01-01", periods=days, freq="D"), names
+            ),
+            "name": pd.Categorical.from_codes(
+                np.repeat(np.arange(names), days),
+                [f"celebrity{i:03}" for i in range(names)],
+            ),
+            "number_of_likes": rng.integers(0, 1_000_000, days * names),
+            "number_of_shares": rng.integers(0, 100_000, days * names),
+        }
+    )
+
+
+def main(chosen=3, repeat=5):
+    print(
+        f"{'rows':>10} {'index ms':>9} {'isin ms':>9} {'slices ms':>9} {'speedup':>8}"
+    )
+    for rows in [1_000, 100_000, 10_000_000]:
+        df = synthetic_daily(rows)
+        names = df["name"].cat.categories
+        chosen_value = list(names[:: len(names) // chosen][:chosen])
+
+        start = timeit.default_timer()
+        slices = name_slices(df)
+        index = timeit.default_timer() - start
+
+        def isin():
+            return df[df["name"].isin(chosen_value)]
+
+        def from_slices():
+            return pd.concat([slices[name] for name in slices if name in chosen_value])
+
+        pd.testing.assert_frame_equal(isin(), from_slices())
+
+        scan = min(timeit.repeat(isin, number=1, repeat=repeat))
+        picked = min(timeit.repeat(from_slices, number=1, repeat=repeat))
+        print(
+            f"{len(df):>10} {index * 1000:>9.2f} {scan * 1000:>9.2f}"
+            f" {picked * 1000:>9.2f} {scan / picked:>7.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""
+Downsampling of the line chart in twitter_app.py.
+
+A graph a thousand pixels wide can't show more than about a thousand points of
+each line, so each series is cut down with Largest-Triangle-Three-Buckets
+(LTTB) to roughly one point per pixel of the graph.  It keeps the points that
+stand out - peaks, dips and jumps - so the line looks the same.  When the user
+zooms in, only the visible dates are downsampled, which soon means every point.
+"""
+import numpy as np
+import pandas as pd
+
+
+def lttb(x, y, points):
+    """returns the indices of the points to keep so the line through x and y
+    still looks the same with only `points` points
+    """
+    n = len(x)
+    if points >= n or points < 3:
+        return np.arange(n)
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+
+    # the first and last points are always kept, the rest are split into buckets
+    edges = np.linspace(1, n - 1, points - 1).astype(int)
+    keep = np.empty(points, dtype=int)
+    keep[0], keep[-1] = 0, n - 1
+
+    a = 0
+    for i in range(points - 2):
+        start, stop = edges[i], edges[i + 1]
+        if i + 2 < len(edges):
+            next_x = x[stop : edges[i + 2]].mean()
+            next_y = y[stop : edges[i + 2]].mean()
+        else:
+            next_x, next_y = x[-1], y[-1]
+        # the point of this bucket making the largest triangle with the point
+        # kept before it and the average of the next bucket
+        area = np.abs(
+            (x[a] - next_x) * (y[start:stop] - y[a])
+            - (x[a] - x[start:stop]) * (next_y - y[a])
+        )
+        a = start + np.argmax(area)
+        keep[i + 1] = a
+    return keep
+
+
+def zoom_range(relayout_data):
+    """returns the (start, end) dates the user zoomed in to, or None"""
+    if not relayout_data:
+        return None
+    if "xaxis.range[0]" in relayout_data:
+        x_range = relayout_data["xaxis.range[0]"], relayout_data["xaxis.range[1]"]
+    elif "xaxis.range" in relayout_data:
+        x_range = relayout_data["xaxis.range"]
+    else:
+        return None
+    return pd.Timestamp(x_range[0]), pd.Timestamp(x_range[1])
+
+
+def downsample(df, points, x_range=None, log_y=True):
+    """returns about `points` daily means of one name, within x_range if given"""
+    dates = df["date_time"].to_numpy()
+    if x_range is not None:
+        # one more point on either side, so the line runs to the edges
+        start = max(np.searchsorted(dates, x_range[0].to_datetime64()) - 1, 0)
+        stop = np.searchsorted(dates, x_range[1].to_datetime64(), side="right") + 1
+        df = df.iloc[start:stop]
+        dates = dates[start:stop]
+
+    likes = df["number_of_likes"].to_numpy()
+    if log_y:
+        # compare the triangles as they look on the log axis
+        likes = np.log10(np.maximum(likes, 1))
+    return df.iloc[lttb(dates.astype("int64"), likes, points)]
@@ -0,0 +1,301 @@
+"""
+Converts tweets.csv into a columnar store, once, so twitter_app.py starts fast.
+
+    python ingest_tweets.py
+
+The store has two parts:
+    tweets_store/tweets/   every tweet, typed and partitioned by year (Parquet)
+    tweets_store/daily.arrow   the daily means by name that the app plots (Arrow)
+
+The app memory-maps daily.arrow at startup, and runs the ingestion itself when
+the store is missing or older than tweets.csv.  The csv is read CHUNK_ROWS at a
+time, keeping only running sums and counts for each day and name, so memory
+use depends on the number of days and names rather than the number of tweets.
+
+The daily means are sorted by name and then date, so the rows of each name are
+one contiguous slice - see name_slices().
+
+New tweets are added without going through tweets.csv again: put csv files of
+them, with the same columns, in tweets_drop/.  new_batches() moves each one to
+tweets_drop/claimed/ under a unique batch id, add_batch() appends the tweets to
+the store, and saves the daily totals of the batch in tweets_store/batches/,
+which load_daily() adds to the daily means.
+"""
+import glob
+import os
+import time
+from functools import reduce
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+import pyarrow.parquet as pq
+
+CSV_FILE = "tweets.csv"
+STORE_DIR = "tweets_store"
+TWEETS_DIR = os.path.join(STORE_DIR, "tweets")
+DAILY_FILE = os.path.join(STORE_DIR, "daily.arrow")
+BATCHES_DIR = os.path.join(STORE_DIR, "batches")
+DROP_DIR = "tweets_drop"
+CLAIMED_DIR = os.path.join(DROP_DIR, "claimed")
+
+COLUMNS = ["name", "date_time", "number_of_likes", "number_of_shares"]
+VALUE_COLUMNS = ["number_of_likes", "number_of_shares"]
+CHUNK_ROWS = 100_000  # rows of the csv read at a time
+
+# the totals behind each daily mean are kept with it, so new tweets can be added
+TOTAL_COLUMNS = {
+    "number_of_likes": "total_likes",
+    "number_of_shares": "total_shares",
+    "count": "tweets",
+}
+
+
+def read_tweets(csv_file=CSV_FILE, chunk_rows=CHUNK_ROWS):
+    """yields the csv in chunks, with the types the app needs"""
+    chunks = pd.read_csv(
+        csv_file,
+        usecols=COLUMNS,
+        dtype={"number_of_likes": "int64", "number_of_shares": "int64"},
+        chunksize=chunk_rows,
+    )
+    for df in chunks:
+        df["name"] = df["name"].str.lower().astype("category")
+        df["date_time"] = pd.to_datetime(df["date_time"], dayfirst=True)
+        yield df
+
+
+def daily_totals(df):
+    """sum of likes and shares, and the number of tweets, for each day and name"""
+    # plain strings, since every chunk has its own categories
+    grouped = df.groupby(
+        [df["date_time"].dt.normalize(), df["name"].astype(str)], sort=False
+    )
+    totals = grouped[VALUE_COLUMNS].sum()
+    totals["count"] = grouped.size()
+    return totals
+
+
+def add_totals(totals, more):
+    """adds the totals of another chunk to the running totals"""
+    if totals is None:
+        return more
+    return pd.concat([totals, more]).groupby(level=[0, 1], sort=False).sum()
+
+
+def daily_means(totals):
+    """mean likes and shares for each day and name, with the running totals"""
+    df = totals.rename(columns=TOTAL_COLUMNS)
+    df[VALUE_COLUMNS] = totals[VALUE_COLUMNS].div(totals["count"], axis=0).astype(int)
+    df = df.reset_index().sort_values(["name", "date_time"], ignore_index=True)
+    df["name"] = df["name"].astype("category")
+    return df
+
+
+def totals_of(daily):
+    """the running totals behind daily means, as daily_totals() returns them"""
+    totals = daily.set_index([daily["date_time"], daily["name"].astype(str)])
+    totals = totals[list(TOTAL_COLUMNS.values())]
+    return totals.rename(columns={v: k for k, v in TOTAL_COLUMNS.items()})
+
+
+def write_tweets(df, basename):
+    """appends tweets to the store, partitioned by year"""
+    tweets = pa.Table.from_pandas(
+        df.assign(year=df["date_time"].dt.year), preserve_index=False
+    )
+    pq.write_to_dataset(
+        tweets,
+        TWEETS_DIR,
+        partition_cols=["year"],
+        basename_template=f"{basename}-{{i}}.parquet",
+        existing_data_behavior="overwrite_or_ignore",
+    )
+
+
+def ingest(csv_file=CSV_FILE, chunk_rows=CHUNK_ROWS):
+    """writes the partitioned tweets and the daily means, one chunk at a time.
+    Tweets added in batches are kept.
+    """
+    for old in glob.glob(os.path.join(TWEETS_DIR, "*", "chunk*.parquet")):
+        os.remove(old)
+    os.makedirs(STORE_DIR, exist_ok=True)
+
+    totals = None
+    for n, df in enumerate(read_tweets(csv_file, chunk_rows)):
+        write_tweets(df, f"chunk{n}")
+        totals = add_totals(totals, daily_totals(df))
+
+    # uncompressed, so the app can memory-map it instead of reading it.  Written
+    # next to it and moved into place, so a stopped ingest leaves no half file.
+    tmp_file = f"{DAILY_FILE}.{os.getpid()}.tmp"
+    feather.write_feather(daily_means(totals), tmp_file, compression="uncompressed")
+    os.replace(tmp_file, DAILY_FILE)
+
+
+def is_stale(csv_file=CSV_FILE):
+    """True if the store is missing or older than the csv"""
+    if not os.path.exists(DAILY_FILE):
+        return True
+    if not os.path.exists(csv_file):
+        return False
+    return os.path.getmtime(csv_file) > os.path.getmtime(DAILY_FILE)
+
+
+def load_daily(csv_file=CSV_FILE):
+    """returns the daily means, ingesting the csv first if the store is stale"""
+    if is_stale(csv_file):
+        ingest(csv_file)
+    table = feather.read_table(DAILY_FILE, memory_map=True)
+    if not set(TOTAL_COLUMNS.values()) <= set(table.column_names):
+        # a store written before the totals were kept
+        ingest(csv_file)
+        table = feather.read_table(DAILY_FILE, memory_map=True)
+    df = table.to_pandas(split_blocks=True)
+
+    batches = [
+        feather.read_feather(batch_file).set_index(["date_time", "name"])
+        for batch_file in sorted(glob.glob(os.path.join(BATCHES_DIR, "*.arrow")))
+    ]
+    if batches:
+        df = daily_means(reduce(add_totals, batches, totals_of(df)))
+    return df
+
+
+def new_batches():
+    """moves the csv files of new tweets waiting in the drop folder to the
+    claimed folder, each named with a unique batch id, and returns the claimed
+    files - with any left there by a run that stopped before adding them
+    """
+    os.makedirs(CLAIMED_DIR, exist_ok=True)
+    for csv_file in sorted(glob.glob(os.path.join(DROP_DIR, "*.csv"))):
+        name = os.path.splitext(os.path.basename(csv_file))[0]
+        batch = f"{name}-{time.time_ns()}"
+        try:
+            os.replace(csv_file, os.path.join(CLAIMED_DIR, batch + ".csv"))
+        except FileNotFoundError:
+            # claimed by another process
+            pass
+    return sorted(glob.glob(os.path.join(CLAIMED_DIR, "*.csv")))
+
+
+def add_batch(csv_file):
+    """adds a csv of new tweets claimed by new_batches() to the store and
+    removes it.  Returns the daily totals of the batch, or None if it had no
+    tweets.
+    """
+    batch = os.path.splitext(os.path.basename(csv_file))[0]
+    batch_file = os.path.join(BATCHES_DIR, batch + ".arrow")
+    if os.path.exists(batch_file):
+        # the same claimed file, added already by a run that stopped before
+        # the csv was removed
+        os.remove(csv_file)
+        return None
+
+    totals = None
+    for n, df in enumerate(read_tweets(csv_file)):
+        write_tweets(df, f"batch-{batch}-{n}")
+        totals = add_totals(totals, daily_totals(df))
+
+    if totals is not None:
+        os.makedirs(BATCHES_DIR, exist_ok=True)
+        feather.write_feather(totals.reset_index(), batch_file + ".tmp")
+        os.replace(batch_file + ".tmp", batch_file)
+    os.remove(csv_file)
+    return totals
+
+
+def name_slices(df):
+    """returns {name: the daily means of that name} for each name, in order of
+    their first tweet.  The slices are views found from the offsets of the
+    categorical codes, so picking names doesn't scan the whole frame.
+    """
+    codes = df["name"].cat.codes.to_numpy()
+    offsets = np.searchsorted(codes, np.arange(len(df["name"].cat.categories) + 1))
+
+    slices = {
+        name: df.iloc[offsets[i] : offsets[i + 1]]
+        for i, name in enumerate(df["name"].cat.categories)
+        if offsets[i] < offsets[i + 1]
+    }
+    return in_first_tweet_order(slices)
+
+
+def in_first_tweet_order(slices):
+    # the same order of lines, and colours, as filtering the rows sorted by date
+    return dict(
+        sorted(slices.items(), key=lambda item: (item[1]["date_time"].iat[0], item[0]))
+    )
+
+
+def day_rows(name, dates, totals, columns, categories):
+    """rows of daily means of one name, from the totals of their days"""
+    df = pd.DataFrame(totals, columns=list(TOTAL_COLUMNS.values()))
+    df[VALUE_COLUMNS] = (totals[:, :2] / totals[:, 2:]).astype(int)
+    df["date_time"] = dates
+    df["name"] = pd.Categorical([name] * len(df), categories=categories)
+    return df[columns]
+
+
+def add_days(daily, name, batch):
+    """adds the daily totals of a batch to the daily means of one name, both
+    sorted by date.  The days found with searchsorted get the batch added to
+    their totals and their means computed again, and rows for the new days are
+    inserted in place - the other days are only copied.
+    """
+    dates = daily["date_time"].to_numpy()
+    batch_dates = batch.index.to_numpy()
+    batch_totals = batch[list(TOTAL_COLUMNS)].to_numpy()
+    pos = np.searchsorted(dates, batch_dates)
+    found = pos < len(dates)
+    found[found] = dates[pos[found]] == batch_dates[found]
+
+    daily = daily.copy()
+    rows = pos[found]
+    total_cols = daily.columns.get_indexer(list(TOTAL_COLUMNS.values()))
+    totals = daily.iloc[rows, total_cols].to_numpy() + batch_totals[found]
+    daily.iloc[rows, total_cols] = totals
+    daily.iloc[rows, daily.columns.get_indexer(VALUE_COLUMNS)] = (
+        totals[:, :2] / totals[:, 2:]
+    ).astype(int)
+    if found.all():
+        return daily
+
+    new = day_rows(
+        name,
+        batch_dates[~found],
+        batch_totals[~found],
+        daily.columns,
+        daily["name"].cat.categories,
+    )
+    # each new day goes before the first day after it
+    order = np.insert(
+        np.arange(len(daily)), pos[~found], len(daily) + np.arange(len(new))
+    )
+    return pd.concat([daily, new], ignore_index=True).take(order).reset_index(drop=True)
+
+
+def merge_slices(slices, totals):
+    """adds the daily totals of a batch to name_slices().  Only the days in the
+    batch are computed again.  Returns the new slices and the names that changed.
+    """
+    names = list(totals.index.unique("name"))
+    slices = dict(slices)
+    for name in names:
+        batch = totals.xs(name, level="name").sort_index()
+        if name in slices:
+            slices[name] = add_days(slices[name], name, batch)
+        else:
+            slices[name] = day_rows(
+                name,
+                batch.index.to_numpy(),
+                batch[list(TOTAL_COLUMNS)].to_numpy(),
+                ["date_time", "name", *TOTAL_COLUMNS.values(), *VALUE_COLUMNS],
+                [name],
+            )
+    return in_first_tweet_order(slices), names
+
+
+if __name__ == "__main__":
+    ingest()
@@ -1,21 +1,58 @@
+import os
+import threading
+import time
+
+import flask
 import pandas as pd
 import plotly.express as px
 
-from dash import Dash, dcc, html, Input, Output
+from dash import Dash, dcc, html, Input, Output, State, ctx
+from dash.exceptions import PreventUpdate
+
+from downsample import downsample, zoom_range
+from ingest_tweets import (
+    DROP_DIR,
+    add_batch,
+    load_daily,
+    merge_slices,
+    name_slices,
+    new_batches,
+)
 
 # Preparing your data for usage *******************************************
 
-df = pd.read_csv("tweets.csv")
-df["name"] = pd.Series(df["name"]).str.lower()
-df["date_time"] = pd.to_datetime(df["date_time"], dayfirst=True)
-df = (
-    df.groupby([df["date_time"].dt.date, "name"])[
-        ["number_of_likes", "number_of_shares"]
-    ]
-    .mean()
-    .astype(int)
-)
-df = df.reset_index()
+# daily mean likes and shares by name, from the store made by ingest_tweets.py
+df = load_daily()
+# the rows of each name, so the callback only touches the names chosen
+slices = name_slices(df)
+
+# points drawn for each line per pixel of the graph width, and the width used
+# until the browser reports it
+POINTS_PER_PIXEL = 1
+DEFAULT_WIDTH = 1000
+
+# New tweets: csv files saved in tweets_drop/, or POSTed to /tweets from this
+# machine, are added to the daily means of their names only, and open graphs
+# showing those names are updated within CHECK_INTERVAL seconds.
+CHECK_INTERVAL = 5
+updates = []  # the names changed by each batch added since the app started
+batches_lock = threading.Lock()
+
+
+def add_new_batches():
+    """adds the batches waiting in the drop folder, and returns the names changed"""
+    global slices
+    changed = set()
+    with batches_lock:
+        for csv_file in new_batches():
+            totals = add_batch(csv_file)
+            if totals is None:
+                continue
+            slices, names = merge_slices(slices, totals)
+            updates.append(names)
+            changed.update(names)
+    return sorted(changed)
+
 
 # App Layout **************************************************************
 
@@ -31,16 +68,16 @@ app.layout = html.Div(
             className="row",
         ),
         html.Div(dcc.Graph(id="line-chart", figure={}), className="row"),
+        dcc.Store(id="graph-width"),
+        dcc.Store(id="data-version"),
+        dcc.Interval(id="check-batches", interval=CHECK_INTERVAL * 1000),
         html.Div(
             [
                 html.Div(
                     dcc.Dropdown(
                         id="my-dropdown",
                         multi=True,
-                        options=[
-                            {"label": x, "value": x}
-                            for x in sorted(df["name"].unique())
-                        ],
+                        options=[{"label": x, "value": x} for x in sorted(slices)],
                         value=["taylorswift13", "cristiano", "jtimberlake"],
                     ),
                     className="three columns",
@@ -62,17 +99,99 @@ app.layout = html.Div(
 
 
 # Callbacks ***************************************************************
+@app.server.route("/tweets", methods=["POST"])
+def post_tweets():
+    if flask.request.remote_addr not in ("127.0.0.1", "::1"):
+        flask.abort(403)
+    os.makedirs(DROP_DIR, exist_ok=True)
+    csv_file = os.path.join(DROP_DIR, f"post-{time.time_ns()}.csv")
+    with open(csv_file + ".tmp", "wb") as f:
+        f.write(flask.request.get_data())
+    os.replace(csv_file + ".tmp", csv_file)
+    return {"names": add_new_batches()}
+
+
+@app.callback(
+    Output("data-version", "data"),
+    Input("check-batches", "n_intervals"),
+    State("data-version", "data"),
+)
+def check_batches(n_intervals, data_version):
+    add_new_batches()
+    seen = data_version["version"] if data_version else 0
+    if len(updates) == seen:
+        raise PreventUpdate
+    # the names changed since this page last looked
+    names = sorted({name for names in updates[seen:] for name in names})
+    return {"version": len(updates), "names": names}
+
+
+@app.callback(
+    Output("my-dropdown", "options"),
+    Input("data-version", "data"),
+    prevent_initial_call=True,
+)
+def update_options(data_version):
+    return [{"label": x, "value": x} for x in sorted(slices)]
+
+
+# the width of the graph in pixels, updated when the graph is drawn or resized
+app.clientside_callback(
+    """
+    function(relayoutData, width) {
+        var graph = document.getElementById("line-chart");
+        if (!graph || graph.offsetWidth === width) {
+            return window.dash_clientside.no_update;
+        }
+        return graph.offsetWidth;
+    }
+    """,
+    Output("graph-width", "data"),
+    Input("line-chart", "relayoutData"),
+    State("graph-width", "data"),
+)
+
+
 @app.callback(
     Output(component_id="line-chart", component_property="figure"),
-    [Input(component_id="my-dropdown", component_property="value")],
+    [
+        Input(component_id="my-dropdown", component_property="value"),
+        Input(component_id="line-chart", component_property="relayoutData"),
+        Input(component_id="graph-width", component_property="data"),
+        Input(component_id="data-version", component_property="data"),
+    ],
 )
-def update_graph(chosen_value):
+def update_graph(chosen_value, relayout_data, width, data_version):
     print(f"Values chosen by user: {chosen_value}")
 
+    if ctx.triggered_id == "data-version":
+        if not set(data_version["names"]).intersection(chosen_value):
+            # new tweets, but none of the names in the graph
+            raise PreventUpdate
+
+    if ctx.triggered_id == "my-dropdown":
+        x_range = None
+    else:
+        x_range = zoom_range(relayout_data)
+        zoomed_out = "xaxis.autorange" in (relayout_data or {})
+        if ctx.triggered_id == "line-chart" and x_range is None and not zoomed_out:
+            # not a change of dates - the graph was drawn or only y was zoomed
+            raise PreventUpdate
+
     if len(chosen_value) == 0:
         return {}
     else:
-        df_filtered = df[df["name"].isin(chosen_value)]
+        # each line cut down to about one point per pixel, or every point when
+        # zoomed in far enough
+        points = int((width or DEFAULT_WIDTH) * POINTS_PER_PIXEL)
+        current = slices  # new batches replace slices, rather than change it
+        df_filtered = pd.concat(
+            [
+                downsample(current[name], points, x_range)
+                for name in current
+                if name in chosen_value
+            ]
+        )
         fig = px.line(
             data_frame=df_filtered,
             x="date_time",
@@ -85,6 +204,8 @@ def update_graph(chosen_value):
                 "name": "Celebrity",
             },
         )
+        # keep the user's zoom when only the resolution changes
+        fig.update_layout(uirevision=" ".join(sorted(chosen_value)))
         return fig
 
 
@@ -0,0 +1,179 @@
+"""
+Builds the simplified country shapes used by the choropleth in worldbank.py.
+
+Download the Natural Earth "Admin 0 - Countries" data as GeoJSON
+(https://www.naturalearthdata.com/downloads/), then run:
+    python build_geometry.py ne_110m_admin_0_countries.geojson
+
+This writes assets/world_low.json, assets/world_medium.json and
+assets/world_high.json.  A border shared by two countries is simplified the
+same way on both sides, so neighbours still meet without gaps or overlaps.
+"""
+import json
+import os
+import sys
+from collections import defaultdict
+
+import numpy as np
+
+# how far, in degrees, a simplified border may stray from the original
+LEVELS = {"low": 0.5, "medium": 0.15, "high": 0.0}
+PRECISION = 3  # decimal places kept in the coordinates
+
+
+def country_id(properties):
+    """ISO3 code of a Natural Earth feature, or None if it doesn't have one"""
+    properties = {k.upper(): v for k, v in properties.items()}
+    iso3c = properties.get("ISO_A3", "-99")
+    if iso3c == "-99":
+        iso3c = properties.get("ADM0_A3", "-99")
+    return None if iso3c == "-99" else iso3c
+
+
+def read_countries(filename):
+    """returns {iso3c: (name, polygons)} where a polygon is a list of rings and
+    a ring is a list of (x, y) points, rounded so shared points match exactly
+    """
+    with open(filename, encoding="utf-8") as f:
+        features = json.load(f)["features"]
+
+    countries = {}
+    for feature in features:
+        iso3c = country_id(feature["properties"])
+        if iso3c is None:
+            continue
+        name = {k.upper(): v for k, v in feature["properties"].items()}["NAME"]
+        geometry = feature["geometry"]
+        polygons = geometry["coordinates"]
+        if geometry["type"] == "Polygon":
+            polygons = [polygons]
+        countries[iso3c] = (
+            name,
+            [
+                [
+                    [(round(x, PRECISION), round(y, PRECISION)) for x, y, *_ in ring]
+                    for ring in polygon
+                ]
+                for polygon in polygons
+            ],
+        )
+    return countries
+
+
+def find_junctions(rings):
+    """returns the points where a border between two countries starts or ends.
+    Everywhere else, a point has the same two neighbours in every ring it is in.
+    """
+    neighbours = defaultdict(set)
+    for ring in rings:
+        points = ring[:-1]
+        for i, point in enumerate(points):
+            pair = frozenset((points[i - 1], points[(i + 1) % len(points)]))
+            neighbours[point].add(pair)
+    return {point for point, pairs in neighbours.items() if len(pairs) > 1}
+
+
+def douglas_peucker(points, tolerance):
+    """returns the points of a line that are needed to keep within tolerance of it"""
+    keep = np.zeros(len(points), dtype=bool)
+    keep[[0, -1]] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        start, end = points[first], points[last]
+        between = points[first + 1 : last]
+        dx, dy = end - start
+        length = np.hypot(dx, dy)
+        if length == 0:
+            distance = np.hypot(*(between - start).T)
+        else:
+            distance = (
+                np.abs(
+                    dx * (between[:, 1] - start[1]) - dy * (between[:, 0] - start[0])
+                )
+                / length
+            )
+        i = np.argmax(distance)
+        if distance[i] > tolerance:
+            middle = first + 1 + i
+            keep[middle] = True
+            stack += [(first, middle), (middle, last)]
+    return points[keep]
+
+
+def simplify_ring(ring, junctions, tolerance):
+    """simplifies each stretch of a ring between junctions, or None if the ring
+    becomes too small to draw
+    """
+    points = ring[:-1]
+    fixed = [i for i, point in enumerate(points) if point in junctions]
+    if not fixed:
+        # islands and enclaves - start from a point any ring sharing them agrees on
+        fixed = [points.index(min(points))]
+
+    simplified = []
+    for first, last in zip(fixed, fixed[1:] + [fixed[0] + len(points)]):
+        stretch = np.array([points[i % len(points)] for i in range(first, last + 1)])
+        simplified += [tuple(p) for p in douglas_peucker(stretch, tolerance)[:-1]]
+    simplified.append(simplified[0])
+    return simplified if len(simplified) >= 4 else None
+
+
+def simplify_country(polygons, junctions, tolerance):
+    simplified = []
+    for polygon in polygons:
+        outer = simplify_ring(polygon[0], junctions, tolerance)
+        if outer is None:
+            continue
+        holes = [simplify_ring(ring, junctions, tolerance) for ring in polygon[1:]]
+        simplified.append([outer] + [hole for hole in holes if hole is not None])
+
+    if not simplified:
+        # too small at this level of detail - keep the largest part unchanged
+        simplified = [max(polygons, key=lambda polygon: len(polygon[0]))]
+    return simplified
+
+
+def to_geojson(countries):
+    features = [
+        {
+            "type": "Feature",
+            "id": iso3c,
+            "properties": {"name": name},
+            "geometry": {"type": "MultiPolygon", "coordinates": polygons},
+        }
+        for iso3c, (name, polygons) in sorted(countries.items())
+    ]
+    return {"type": "FeatureCollection", "features": features}
+
+
+def main(filename):
+    countries = read_countries(filename)
+    junctions = find_junctions(
+        ring
+        for _, polygons in countries.values()
+        for polygon in polygons
+        for ring in polygon
+    )
+
+    os.makedirs("assets", exist_ok=True)
+    for level, tolerance in LEVELS.items():
+        simplified = {
+            iso3c: (name, simplify_country(polygons, junctions, tolerance))
+            for iso3c, (name, polygons) in countries.items()
+        }
+        with open(f"assets/world_{level}.json", "w", encoding="utf-8") as f:
+            json.dump(to_geojson(simplified), f, separators=(",", ":"))
+        points = sum(
+            len(ring)
+            for _, polygons in simplified.values()
+            for polygon in polygons
+            for ring in polygon
+        )
+        print(f"world_{level}.json: {len(simplified)} countries, {points} points")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1])
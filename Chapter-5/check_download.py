@@ -0,0 +1,45 @@
+"""
+Checks the chunked downloader in wb_data.py against wb.download, using the
+local stand-in from wb_standin.py so it runs offline.
+
+    python check_download.py
+"""
+import os
+import threading
+
+import pandas as pd
+
+import wb_standin
+
+
+def main():
+    server = wb_standin.serve(port=0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    os.environ["WB_API_URL"] = f"http://127.0.0.1:{server.server_address[1]}/v2"
+
+    # import after WB_API_URL is set, so wb_data talks to the stand-in
+    import wb_data
+    from pandas_datareader import wb
+
+    codes = wb_data.get_countries()["iso3c"]
+    expected = wb.download(
+        indicator=list(wb_data.indicators), country=codes, start=2005, end=2016
+    ).reset_index()
+
+    # small chunks, and a few failed requests to exercise the retries
+    wb_data.COUNTRY_CHUNK = 4
+    wb_data.BACKOFF = 0.01
+    wb_standin.WorldBankHandler.fail_next = 3
+    result = wb_data.download_indicators(list(wb_data.indicators), codes, 2005, 2016)
+
+    sort = ["country", "year"]
+    pd.testing.assert_frame_equal(
+        result.sort_values(sort, ignore_index=True),
+        expected.sort_values(sort, ignore_index=True),
+    )
+    print(f"{len(result)} rows match wb.download")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,40 @@
+"""
+Checks year_range_mean() in wb_data.py against the pandas groupby it replaced,
+for every indicator and every range of years in the cached data.
+
+Run it after the app has downloaded the data once:
+    python check_year_means.py
+"""
+import pandas as pd
+
+from wb_data import indicators, read_data, year_range_mean
+
+
+def groupby_mean(df, indicator, years):
+    """the original update_graph calculation"""
+    dff = df[df.year.between(years[0], years[1])]
+    dff = dff.groupby(["iso3c", "country"])[indicator].mean()
+    return dff.reset_index()
+
+
+def main():
+    df = read_data()
+    if df is None:
+        raise SystemExit("No cached data yet - run worldbank.py or wb_data.py first")
+
+    first_year, last_year = df["year"].min(), df["year"].max()
+    checked = 0
+    for indicator in indicators.values():
+        for start in range(first_year - 1, last_year + 2):
+            for end in range(start + 1, last_year + 2):
+                pd.testing.assert_frame_equal(
+                    year_range_mean(indicator, [start, end]),
+                    groupby_mean(df, indicator, [start, end]),
+                    check_dtype=False,
+                )
+                checked += 1
+    print(f"{checked} year ranges match")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,424 @@
+"""
+World Bank data for worldbank.py.
+
+A background refresher downloads the indicators into a Parquet file on disk,
+and the Dash callbacks only ever read that file.  Run this file on its own to
+keep the cache fresh from a single separate process:
+    python wb_data.py
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+from functools import reduce
+
+import numpy as np
+import pandas as pd
+import requests
+from pandas_datareader import wb
+
+# To work offline, point WB_API_URL at a stand-in such as wb_standin.py
+wb.WB_API_URL = os.environ.get("WB_API_URL", wb.WB_API_URL)
+
+CACHE_DIR = "data_cache"
+DATA_FILE = os.path.join(CACHE_DIR, "wb_data.parquet")
+META_FILE = os.path.join(CACHE_DIR, "wb_data.json")
+LOCK_FILE = os.path.join(CACHE_DIR, "wb_data.lock")
+
+CACHE_TTL = 60 * 60  # seconds before the data is downloaded again
+CHECK_INTERVAL = 60  # seconds between checks of the cache age
+LOCK_TIMEOUT = 10 * 60  # a lock older than this was left by a crashed refresher
+
+indicators = {
+    "IT.NET.USER.ZS": "Individuals using the Internet (% of population)",
+    "SG.GEN.PARL.ZS": "Proportion of seats held by women in national parliaments (%)",
+    "EN.ATM.CO2E.KT": "CO2 emissions (kt)",
+}
+
+"""
+==========================================================================
+Country names and ISO ids
+"""
+
+# The country list rarely changes, so it is saved to disk and only downloaded
+# when the file is missing, older than COUNTRIES_TTL, or has another version.
+# Bump COUNTRIES_VERSION when download_countries() changes.
+COUNTRIES_FILE = os.path.join(CACHE_DIR, "countries.json")
+COUNTRIES_TTL = 7 * 24 * 60 * 60
+COUNTRIES_VERSION = 1
+
+_countries = {"df": None}
+_countries_lock = threading.Lock()
+
+
+def download_countries():
+    # get country name and ISO id for mapping on choropleth
+    countries = wb.get_countries()
+    countries["capitalCity"].replace({"": None}, inplace=True)
+    countries.dropna(subset=["capitalCity"], inplace=True)
+    countries = countries[["name", "iso3c"]]
+    countries = countries[countries["name"] != "Kosovo"]
+    countries = countries.rename(columns={"name": "country"})
+    return countries.reset_index(drop=True)
+
+
+def load_countries():
+    """reads the countries from disk, downloading them when the file is stale"""
+    try:
+        with open(COUNTRIES_FILE) as f:
+            saved = json.load(f)
+    except (FileNotFoundError, ValueError):
+        saved = None
+
+    if (
+        saved is not None
+        and saved["version"] == COUNTRIES_VERSION
+        and saved["api_url"] == wb.WB_API_URL
+        and time.time() - saved["fetched_at"] < COUNTRIES_TTL
+    ):
+        return pd.DataFrame(saved["countries"])
+
+    try:
+        countries = download_countries()
+    except Exception:
+        if saved is None or saved["version"] != COUNTRIES_VERSION:
+            raise
+        # the API is down - an old list is better than none
+        return pd.DataFrame(saved["countries"])
+
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    with open(COUNTRIES_FILE + ".tmp", "w") as f:
+        json.dump(
+            {
+                "version": COUNTRIES_VERSION,
+                "api_url": wb.WB_API_URL,
+                "fetched_at": time.time(),
+                "countries": countries.to_dict("records"),
+            },
+            f,
+        )
+    os.replace(COUNTRIES_FILE + ".tmp", COUNTRIES_FILE)
+    return countries
+
+
+def get_countries():
+    """returns the country names and ISO ids, loaded on first use"""
+    with _countries_lock:
+        if _countries["df"] is None:
+            _countries["df"] = load_countries()
+        return _countries["df"]
+
+
+"""
+==========================================================================
+Downloader
+"""
+
+# The data is downloaded in chunks of one indicator and up to COUNTRY_CHUNK
+# countries, MAX_WORKERS at a time, so a refresh takes about as long as the
+# slowest chunk rather than all of them one after the other.
+COUNTRY_CHUNK = 50
+MAX_WORKERS = 8
+RETRIES = 4
+BACKOFF = 0.5  # seconds to wait before the first retry, doubled each time
+
+session = requests.Session()
+session.mount("http://", requests.adapters.HTTPAdapter(pool_maxsize=MAX_WORKERS))
+session.mount("https://", requests.adapters.HTTPAdapter(pool_maxsize=MAX_WORKERS))
+
+
+def download_chunk(indicator, codes, start, end):
+    """returns a dataframe with country, year and indicator columns, or raises
+    ValueError if the API rejects the indicator
+    """
+    url = f"{wb.WB_API_URL}/countries/{';'.join(codes)}/indicators/{indicator}"
+    params = {"date": f"{start}:{end}", "format": "json", "per_page": 25000}
+
+    # only failed connections and server errors are worth another try
+    for attempt in range(RETRIES + 1):
+        try:
+            response = session.get(url, params=params, timeout=30)
+        except requests.RequestException:
+            if attempt == RETRIES:
+                raise
+        else:
+            if response.status_code < 500 or attempt == RETRIES:
+                break
+        time.sleep(BACKOFF * 2**attempt)
+    response.raise_for_status()
+
+    out = response.json()
+    if "message" in out[0]:
+        raise ValueError(f"Problem with a World Bank query: {out[0]['message']}")
+
+    rows = out[1] or []
+    return pd.DataFrame(
+        {
+            "country": [x["country"]["value"] for x in rows],
+            "year": [x["date"] for x in rows],
+            indicator: [x["value"] for x in rows],
+        }
+    )
+
+
+def download_indicators(indicator_ids, codes, start, end):
+    """returns the same dataframe as wb.download(...).reset_index(): like
+    wb.download, indicators the API rejects or has no data for are left out
+    with a warning, and ValueError is raised if none of them returned data
+    """
+    codes = list(codes)
+    chunks = [
+        (indicator, codes[i : i + COUNTRY_CHUNK])
+        for indicator in indicator_ids
+        for i in range(0, len(codes), COUNTRY_CHUNK)
+    ]
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        futures = [
+            executor.submit(download_chunk, indicator, chunk, start, end)
+            for indicator, chunk in chunks
+        ]
+        results = {ind: [] for ind in indicator_ids}
+        bad_indicators = set()
+        for (indicator, _), future in zip(chunks, futures):
+            try:
+                results[indicator].append(future.result())
+            except ValueError:
+                bad_indicators.add(indicator)
+
+    data = []
+    good_indicators = []
+    for ind in indicator_ids:
+        if ind not in bad_indicators:
+            df = pd.concat(results[ind], ignore_index=True)
+            if len(df):
+                data.append(df)
+                good_indicators.append(ind)
+                continue
+        warnings.warn(f"Failed to obtain indicator {ind}")
+
+    if not data:
+        raise ValueError("No indicators returned data.")
+
+    df = reduce(lambda x, y: x.merge(y, how="outer"), data)
+    df[good_indicators] = df[good_indicators].apply(pd.to_numeric)
+    return df
+
+
+def update_wb_data():
+    countries = get_countries()
+
+    # Retrieve specific world bank data from API
+    df = download_indicators(list(indicators), countries["iso3c"], 2005, 2016)
+    df.year = df.year.astype(int)
+
+    # Add country ISO3 id to main df
+    df = pd.merge(df, countries, on="country")
+    df = df.rename(columns=indicators)
+    # an indicator that was left out has no data to show on the map
+    for name in indicators.values():
+        if name not in df:
+            df[name] = np.nan
+    return df
+
+
+"""
+==========================================================================
+On-disk cache
+"""
+
+
+def read_meta():
+    """returns the version and download time of the cached data, or None"""
+    try:
+        with open(META_FILE) as f:
+            meta = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+    # a cache written before versions were saved is downloaded again
+    return meta if "version" in meta else None
+
+
+def write_data(df):
+    """saves the data, only replacing the Parquet file when the data changed"""
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    # the version is a hash of the data
+    version = hashlib.md5(
+        pd.util.hash_pandas_object(df).to_numpy().tobytes()
+    ).hexdigest()
+
+    meta = read_meta()
+    if meta is None or meta["version"] != version:
+        df.to_parquet(DATA_FILE + ".tmp", index=False)
+        os.replace(DATA_FILE + ".tmp", DATA_FILE)
+
+    # write the meta data last, so readers never see a version without its data
+    with open(META_FILE + ".tmp", "w") as f:
+        json.dump({"version": version, "fetched_at": time.time()}, f)
+    os.replace(META_FILE + ".tmp", META_FILE)
+
+
+_loaded = {"version": None, "df": None, "year_sums": None}
+
+
+def read_data():
+    """returns the cached data, or None if nothing was downloaded yet.
+    The file is only read again when its version changes.
+    """
+    meta = read_meta()
+    if meta is None:
+        return None
+    if meta["version"] != _loaded["version"]:
+        _loaded["df"] = pd.read_parquet(DATA_FILE)
+        _loaded["year_sums"] = None
+        _loaded["version"] = meta["version"]
+    return _loaded["df"]
+
+
+def data_version():
+    """returns the version of the cached data, or None if nothing was downloaded yet"""
+    meta = read_meta()
+    return None if meta is None else meta["version"]
+
+
+def select_data(indicator, years):
+    """returns the rows for a range of years with only the columns the map needs"""
+    df = read_data()
+    return df.loc[
+        df["year"].between(years[0], years[1]), ["iso3c", "country", "year", indicator]
+    ]
+
+
+"""
+==========================================================================
+Means over a range of years
+"""
+
+
+def build_year_sums(df):
+    """returns running totals by country over the years: the number of rows, and
+    for each indicator the sum and the count of values that are not NaN
+    """
+    groups = df[["iso3c", "country"]].drop_duplicates()
+    groups = groups.sort_values(["iso3c", "country"], ignore_index=True)
+    group = pd.MultiIndex.from_frame(groups).get_indexer(
+        pd.MultiIndex.from_frame(df[["iso3c", "country"]])
+    )
+
+    # column 0 is before the first year, so a range is the difference of two columns
+    first_year = df["year"].min()
+    col = (df["year"] - first_year + 1).to_numpy()
+    shape = (len(groups), df["year"].max() - first_year + 2)
+
+    rows = np.zeros(shape)
+    np.add.at(rows, (group, col), 1)
+
+    sums = {}
+    counts = {}
+    for indicator in indicators.values():
+        values = df[indicator].to_numpy(dtype=float)
+        has_value = ~np.isnan(values)
+        sums[indicator] = np.zeros(shape)
+        counts[indicator] = np.zeros(shape)
+        np.add.at(
+            sums[indicator], (group[has_value], col[has_value]), values[has_value]
+        )
+        np.add.at(counts[indicator], (group[has_value], col[has_value]), 1)
+        sums[indicator] = sums[indicator].cumsum(axis=1)
+        counts[indicator] = counts[indicator].cumsum(axis=1)
+
+    return {
+        "groups": groups,
+        "first_year": first_year,
+        "rows": rows.cumsum(axis=1),
+        "sums": sums,
+        "counts": counts,
+    }
+
+
+def year_range_mean(indicator, years):
+    """returns the mean of an indicator by country over a range of years - the
+    same as df.groupby(["iso3c", "country"]).mean() on the rows in the range
+    """
+    read_data()
+    if _loaded["year_sums"] is None:
+        _loaded["year_sums"] = build_year_sums(_loaded["df"])
+    year_sums = _loaded["year_sums"]
+
+    last_col = year_sums["rows"].shape[1] - 1
+    start = np.clip(years[0] - year_sums["first_year"], 0, last_col)
+    end = np.clip(years[1] - year_sums["first_year"] + 1, 0, last_col)
+
+    def between(running_total):
+        return running_total[:, end] - running_total[:, start]
+
+    # like pandas, skip NaN and return NaN when a country has no values
+    with np.errstate(invalid="ignore"):
+        mean = between(year_sums["sums"][indicator]) / between(
+            year_sums["counts"][indicator]
+        )
+
+    dff = year_sums["groups"].assign(**{indicator: mean})
+    # groupby only has countries with rows in the range
+    return dff[between(year_sums["rows"]) > 0].reset_index(drop=True)
+
+
+"""
+==========================================================================
+Background refresher
+"""
+
+
+def claim_refresh():
+    """returns True if this process should download - every gunicorn worker
+    runs a refresher, but only one of them downloads at a time
+    """
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    try:
+        os.close(os.open(LOCK_FILE, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+        return True
+    except FileExistsError:
+        pass
+
+    try:
+        if time.time() - os.path.getmtime(LOCK_FILE) > LOCK_TIMEOUT:
+            os.remove(LOCK_FILE)
+    except FileNotFoundError:
+        pass
+    return False
+
+
+def refresh():
+    """downloads the data if the cache is missing or older than CACHE_TTL"""
+    meta = read_meta()
+    if meta is not None and time.time() - meta["fetched_at"] < CACHE_TTL:
+        return
+    if not claim_refresh():
+        return
+    try:
+        write_data(update_wb_data())
+    finally:
+        os.remove(LOCK_FILE)
+
+
+def run_refresher():
+    while True:
+        try:
+            refresh()
+        except Exception as e:
+            # keep serving the last cached data, and try again later
+            print(f"World Bank refresh failed: {e}")
+        time.sleep(CHECK_INTERVAL)
+
+
+def start_refresher():
+    """runs the refresher in a background thread of this process"""
+    thread = threading.Thread(target=run_refresher, name="wb-refresher", daemon=True)
+    thread.start()
+    return thread
+
+
+if __name__ == "__main__":
+    run_refresher()
@@ -0,0 +1,130 @@
+"""
+A local stand-in for the World Bank API, so worldbank.py can run offline.
+
+It answers the two kinds of requests the app makes - the country list and
+indicator values by country and year - with made up, repeatable numbers.
+
+Run it, then point the app at it:
+    python wb_standin.py
+    WB_API_URL=http://127.0.0.1:5050/v2 python worldbank.py
+"""
+import hashlib
+import json
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+HOST = "127.0.0.1"
+PORT = 5050
+
+# iso3c, iso2c, name, capital city.  Aggregates have no capital city.
+COUNTRIES = [
+    ("ARG", "AR", "Argentina", "Buenos Aires"),
+    ("AUS", "AU", "Australia", "Canberra"),
+    ("BRA", "BR", "Brazil", "Brasilia"),
+    ("CAN", "CA", "Canada", "Ottawa"),
+    ("CHN", "CN", "China", "Beijing"),
+    ("DEU", "DE", "Germany", "Berlin"),
+    ("EGY", "EG", "Egypt, Arab Rep.", "Cairo"),
+    ("FRA", "FR", "France", "Paris"),
+    ("GBR", "GB", "United Kingdom", "London"),
+    ("IND", "IN", "India", "New Delhi"),
+    ("JPN", "JP", "Japan", "Tokyo"),
+    ("KEN", "KE", "Kenya", "Nairobi"),
+    ("MEX", "MX", "Mexico", "Mexico City"),
+    ("NGA", "NG", "Nigeria", "Abuja"),
+    ("RUS", "RU", "Russian Federation", "Moscow"),
+    ("SWE", "SE", "Sweden", "Stockholm"),
+    ("USA", "US", "United States", "Washington D.C."),
+    ("ZAF", "ZA", "South Africa", "Pretoria"),
+    ("XKX", "XK", "Kosovo", "Pristina"),
+    ("WLD", "1W", "World", ""),
+    ("ARB", "1A", "Arab World", ""),
+]
+
+
+def value(iso3c, indicator, year):
+    """a repeatable made up value, with some years missing"""
+    digest = hashlib.md5(f"{iso3c}{indicator}{year}".encode()).digest()
+    if digest[0] < 20:
+        return None
+    return round(int.from_bytes(digest[1:4], "big") / 2**24 * 100, 3)
+
+
+def country_list():
+    region = {"id": "", "iso2code": "", "value": ""}
+    return [
+        {
+            "id": iso3c,
+            "iso2Code": iso2c,
+            "name": name,
+            "region": region,
+            "adminregion": region,
+            "incomeLevel": region,
+            "lendingType": region,
+            "capitalCity": capital,
+            "longitude": "",
+            "latitude": "",
+        }
+        for iso3c, iso2c, name, capital in COUNTRIES
+    ]
+
+
+def indicator_values(codes, indicator, date):
+    start, _, end = date.partition(":")
+    years = range(int(start), int(end or start) + 1)
+    return [
+        {
+            "indicator": {"id": indicator, "value": indicator},
+            "country": {"id": iso2c, "value": name},
+            "countryiso3code": iso3c,
+            "date": str(year),
+            "value": value(iso3c, indicator, year),
+        }
+        for iso3c, iso2c, name, _ in COUNTRIES
+        if iso3c in codes or iso2c in codes
+        for year in reversed(years)
+    ]
+
+
+class WorldBankHandler(BaseHTTPRequestHandler):
+    # set to make the next requests fail, to try out retries
+    fail_next = 0
+
+    def do_GET(self):
+        if WorldBankHandler.fail_next > 0:
+            WorldBankHandler.fail_next -= 1
+            self.send_error(503)
+            return
+
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        parts = [p for p in url.path.split("/") if p]
+
+        # /v2/countries/  or  /v2/countries/<codes>/indicators/<indicator>
+        if parts[1:] == ["countries"]:
+            rows = country_list()
+        elif len(parts) == 5 and parts[1] == "countries" and parts[3] == "indicators":
+            codes = set(parts[2].upper().split(";"))
+            rows = indicator_values(codes, parts[4], query["date"][0])
+        else:
+            self.send_error(404)
+            return
+
+        header = {"page": 1, "pages": 1, "per_page": len(rows), "total": len(rows)}
+        body = json.dumps([header, rows]).encode()
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def serve(host=HOST, port=PORT):
+    """returns the server - call serve_forever() to start answering requests"""
+    return ThreadingHTTPServer((host, port), WorldBankHandler)
+
+
+if __name__ == "__main__":
+    print(f"World Bank stand-in at http://{HOST}:{PORT}/v2")
+    serve().serve_forever()
@@ -1,39 +1,63 @@
-from dash import Dash, html, dcc, Input, Output, State
-import plotly.express as px
+import json
+
+from dash import Dash, html, dcc, Input, Output, State, Patch
+from dash.exceptions import PreventUpdate
+import plotly.graph_objects as go
 import dash_bootstrap_components as dbc
-import pandas as pd
-from pandas_datareader import wb
+
+from wb_data import (
+    indicators,
+    data_version,
+    select_data,
+    start_refresher,
+    year_range_mean,
+)
 
 
 app = Dash(__name__, external_stylesheets=[dbc.themes.BOOTSTRAP])
 
-indicators = {
-    "IT.NET.USER.ZS": "Individuals using the Internet (% of population)",
-    "SG.GEN.PARL.ZS": "Proportion of seats held by women in national parliaments (%)",
-    "EN.ATM.CO2E.KT": "CO2 emissions (kt)",
+labels = {
+    indicators["SG.GEN.PARL.ZS"]: "% parliament women",
+    indicators["IT.NET.USER.ZS"]: "pop % using internet",
 }
 
-# get country name and ISO id for mapping on choropleth
-countries = wb.get_countries()
-countries["capitalCity"].replace({"": None}, inplace=True)
-countries.dropna(subset=["capitalCity"], inplace=True)
-countries = countries[["name", "iso3c"]]
-countries = countries[countries["name"] != "Kosovo"]
-countries = countries.rename(columns={"name": "country"})
-
-
-def update_wb_data():
-    # Retrieve specific world bank data from API
-    df = wb.download(
-        indicator=(list(indicators)), country=countries["iso3c"], start=2005, end=2016
+# Country shapes simplified by build_geometry.py, served from the assets folder.
+# The browser downloads them once; after that only the colors are sent.
+with open("assets/world_low.json", encoding="utf-8") as f:
+    map_features = json.load(f)["features"]
+map_ids = [feature["id"] for feature in map_features]
+map_names = [feature["properties"]["name"] for feature in map_features]
+
+
+def map_geojson(zoom):
+    """url of the country shapes with enough detail for the zoom level"""
+    level = "low" if zoom < 2 else "medium" if zoom < 4 else "high"
+    return app.get_asset_url(f"world_{level}.json")
+
+
+def make_map():
+    """the choropleth with every country and no data - update_graph fills it in"""
+    fig = go.Figure(
+        go.Choropleth(
+            geojson=map_geojson(1),
+            featureidkey="id",
+            locations=map_ids,
+            z=[None] * len(map_ids),
+            text=map_names,
+            colorscale="Plasma",
+        )
+    )
+    fig.update_layout(
+        geo={"projection": {"type": "natural earth"}},
+        margin=dict(l=50, r=50, t=50, b=50),
+        # keep the user's zoom when the data or the country shapes change
+        uirevision="choropleth",
     )
-    df = df.reset_index()
-    df.year = df.year.astype(int)
+    return fig
+
 
-    # Add country ISO3 id to main df
-    df = pd.merge(df, countries, on="country")
-    df = df.rename(columns=indicators)
-    return df
+# download the data in the background - callbacks only read the on-disk cache
+start_refresher()
 
 
 app.layout = dbc.Container(
@@ -45,7 +69,7 @@ app.layout = dbc.Container(
                         "Comparison of World Bank Country Data",
                         style={"textAlign": "center"},
                     ),
-                    dcc.Graph(id="my-choropleth", figure={}),
+                    dcc.Graph(id="my-choropleth", figure=make_map()),
                 ],
                 width=12,
             )
@@ -110,16 +134,24 @@ app.layout = dbc.Container(
                 ),
             ]
         ),
-        dcc.Store(id="storage", storage_type="session", data={}),
+        # holds only the version of the data - the data itself stays on the server
+        dcc.Store(id="storage", storage_type="session"),
         dcc.Interval(id="timer", interval=1000 * 60, n_intervals=0),
     ]
 )
 
 
-@app.callback(Output("storage", "data"), Input("timer", "n_intervals"))
-def store_data(n_time):
-    dataframe = update_wb_data()
-    return dataframe.to_dict("records")
+@app.callback(
+    Output("storage", "data"),
+    Input("timer", "n_intervals"),
+    State("storage", "data"),
+)
+def store_data(n_time, stored_version):
+    version = data_version()
+    if version is None or version == stored_version:
+        # nothing downloaded yet, or the map already shows this data
+        raise PreventUpdate
+    return version
 
 
 @app.callback(
@@ -129,50 +161,39 @@ def store_data(n_time):
     State("years-range", "value"),
     State("radio-indicator", "value"),
 )
-def update_graph(n_clicks, stored_dataframe, years_chosen, indct_chosen):
-    dff = pd.DataFrame.from_records(stored_dataframe)
+def update_graph(n_clicks, stored_version, years_chosen, indct_chosen):
+    if stored_version is None:
+        raise PreventUpdate
     print(years_chosen)
 
     if years_chosen[0] != years_chosen[1]:
-        dff = dff[dff.year.between(years_chosen[0], years_chosen[1])]
-        dff = dff.groupby(["iso3c", "country"])[indct_chosen].mean()
-        dff = dff.reset_index()
-
-        fig = px.choropleth(
-            data_frame=dff,
-            locations="iso3c",
-            color=indct_chosen,
-            scope="world",
-            hover_data={"iso3c": False, "country": True},
-            labels={
-                indicators["SG.GEN.PARL.ZS"]: "% parliament women",
-                indicators["IT.NET.USER.ZS"]: "pop % using internet",
-            },
-        )
-        fig.update_layout(
-            geo={"projection": {"type": "natural earth"}},
-            margin=dict(l=50, r=50, t=50, b=50),
-        )
-        return fig
-
-    if years_chosen[0] == years_chosen[1]:
-        dff = dff[dff["year"].isin(years_chosen)]
-        fig = px.choropleth(
-            data_frame=dff,
-            locations="iso3c",
-            color=indct_chosen,
-            scope="world",
-            hover_data={"iso3c": False, "country": True},
-            labels={
-                indicators["SG.GEN.PARL.ZS"]: "% parliament women",
-                indicators["IT.NET.USER.ZS"]: "pop % using internet",
-            },
-        )
-        fig.update_layout(
-            geo={"projection": {"type": "natural earth"}},
-            margin=dict(l=50, r=50, t=50, b=50),
-        )
-        return fig
+        dff = year_range_mean(indct_chosen, years_chosen)
+    else:
+        dff = select_data(indct_chosen, years_chosen)
+
+    # the shapes are already in the browser, so only send the colors
+    values = dff.set_index("iso3c")[indct_chosen].reindex(map_ids)
+    label = labels.get(indct_chosen, indct_chosen)
+    fig = Patch()
+    fig["data"][0]["z"] = values.astype(object).where(values.notna(), None).tolist()
+    fig["data"][0]["colorbar"]["title"]["text"] = label
+    fig["data"][0]["hovertemplate"] = f"%{{text}}<br>{label}: %{{z}}<extra></extra>"
+    return fig
+
+
+@app.callback(
+    Output("my-choropleth", "figure", allow_duplicate=True),
+    Input("my-choropleth", "relayoutData"),
+    prevent_initial_call=True,
+)
+def update_map_detail(relayout_data):
+    """switch to more detailed country shapes when zoomed in"""
+    scale = (relayout_data or {}).get("geo.projection.scale")
+    if scale is None:
+        raise PreventUpdate
+    fig = Patch()
+    fig["data"][0]["geojson"] = map_geojson(scale)
+    return fig
 
 
 if __name__ == "__main__":
@@ -1,8 +1,25 @@
 # -*- coding: utf-8 -*-
-from dash import Dash, dcc, html, dash_table, Input, Output, State, callback_context
+from dash import (
+    Dash,
+    dcc,
+    html,
+    dash_table,
+    Input,
+    Output,
+    State,
+    Patch,
+    callback_context,
+    no_update,
+)
 import dash_bootstrap_components as dbc
 import plotly.graph_objects as go
 import pandas as pd
+import numpy as np
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
 
 app = Dash(
     __name__,
@@ -104,12 +121,14 @@ footer = html.Div(
 Tables
 """
 
+TABLE_COLUMNS = ["Year", "Cash", "Bonds", "Stocks", "Total"]
+
 total_returns_table = dash_table.DataTable(
     id="total_returns",
     columns=[{"id": "Year", "name": "Year", "type": "text"}]
     + [
         {"id": col, "name": col, "type": "numeric", "format": {"specifier": "$,.0f"}}
-        for col in ["Cash", "Bonds", "Stocks", "Total"]
+        for col in TABLE_COLUMNS[1:]
     ],
     page_size=15,
     style_table={"overflowX": "scroll"},
@@ -155,15 +174,15 @@ def make_summary_table(dff):
         {
             "": [cash, bonds, stocks, inflation],
             f"Rate of Return (CAGR) from {start_yr} to {end_yr}": [
-                cagr(dff["all_cash"]),
-                cagr(dff["all_bonds"]),
-                cagr(dff["all_stocks"]),
-                cagr(dff["inflation_only"]),
+                cagr("3-mon T.Bill", start_yr + 1, end_yr),
+                cagr("10yr T.Bond", start_yr + 1, end_yr),
+                cagr("S&P 500", start_yr + 1, end_yr),
+                cagr("Inflation", start_yr + 1, end_yr),
             ],
             f"Worst 1 Year Return": [
-                worst(dff, "3-mon T.Bill"),
-                worst(dff, "10yr T.Bond"),
-                worst(dff, "S&P 500"),
+                worst("3-mon T.Bill", start_yr, end_yr),
+                worst("10yr T.Bond", start_yr, end_yr),
+                worst("S&P 500", start_yr, end_yr),
                 "",
             ],
         }
@@ -262,6 +281,88 @@ def make_line_chart(dff):
     return fig
 
 
+def make_returns_patch(dff, shown_dff):
+    """Make Patch objects for the line chart and the returns table that only
+    send the trace y-arrays and table cells that differ from what is shown.
+    Both dataframes must cover the same years.
+    """
+    fig = Patch()
+    # in the same order as the traces in make_line_chart
+    trace_columns = ["all_cash", "all_bonds", "all_stocks", "Total", "inflation_only"]
+    for i, col in enumerate(trace_columns):
+        if not dff[col].equals(shown_dff[col]):
+            fig["data"][i]["y"] = dff[col].tolist()
+
+    table = dff[TABLE_COLUMNS]
+    changed = (table != shown_dff[TABLE_COLUMNS]).to_numpy()
+    if changed.sum() > changed.size / 4:
+        # each patched cell costs a few times more than the value itself
+        return table.to_dict("records"), fig
+
+    data = Patch()
+    for row, col in zip(*np.nonzero(changed)):
+        data[int(row)][TABLE_COLUMNS[col]] = table.iat[row, col].item()
+    return data, fig
+
+
+"""
+==========================================================================
+Figure cache
+"""
+
+
+class FigureCache:
+    """Least recently used cache of figures as plain JSON dicts.
+
+    Users keep returning to the same allocations and time periods, so a repeat
+    request returns the serialized figure without building a go.Figure.
+    """
+
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self.figures = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, make_figure):
+        """returns the cached figure for key, or calls make_figure() and caches it"""
+        with self.lock:
+            if key in self.figures:
+                self.hits += 1
+                self.figures.move_to_end(key)
+                return self.figures[key]
+            self.misses += 1
+
+        figure = json.loads(make_figure().to_json())
+
+        with self.lock:
+            self.figures[key] = figure
+            self.figures.move_to_end(key)
+            while len(self.figures) > self.maxsize:
+                self.figures.popitem(last=False)
+                self.evictions += 1
+        return figure
+
+    def stats(self):
+        return {
+            "size": len(self.figures),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+figure_cache = FigureCache()
+
+
+@app.server.route("/figure-cache-stats")
+def figure_cache_stats():
+    return figure_cache.stats()
+
+
 """
 ==========================================================================
 Make Tabs
@@ -468,6 +569,125 @@ tabs = dbc.Tabs(
 )
 
 
+"""
+==========================================================================
+Precomputed portfolio growth for every allocation on the slider grid
+"""
+
+# The sliders move in steps of 5%, so there are only a few hundred possible
+# allocations.  For each one, store the growth of $1 invested at the end of
+# MIN_YR - 1 and rebalanced annually.  The growth over any start year and
+# planning period is then the ratio of two entries.
+ALLOCATION_STEP = 5
+CUBE_FILE = "allocation_cube.npz"
+
+
+def data_version():
+    """returns a checksum of the spreadsheet so a stale cube is rebuilt"""
+    with open("assets/historic.csv", "rb") as f:
+        return hashlib.md5(f.read()).hexdigest()
+
+
+def build_allocation_cube():
+    """returns an array [cash, stocks, year] of the cumulative growth of $1"""
+    growth = 1 + df[["3-mon T.Bill", "10yr T.Bond", "S&P 500"]].to_numpy()
+    pct = np.arange(0, 101, ALLOCATION_STEP)
+    cash, stocks = np.meshgrid(pct, pct, indexing="ij")
+    bonds = 100 - cash - stocks
+    allocation = np.stack([cash, bonds, stocks], axis=-1) / 100
+    cube = np.cumprod(allocation @ growth.T, axis=-1)
+    # stocks and cash can't add up to more than 100%
+    cube[bonds < 0] = np.nan
+    return cube
+
+
+def load_allocation_cube():
+    """reads the cube from disk, or builds and saves it when missing or stale"""
+    version = data_version()
+    if os.path.exists(CUBE_FILE):
+        with np.load(CUBE_FILE) as saved:
+            if saved["version"] == version:
+                return saved["cube"]
+    cube = build_allocation_cube()
+    # written to a temporary file and then renamed, so another worker starting
+    # at the same time never loads half a file.  savez adds .npz to file names,
+    # so it is given an open file instead
+    tmp_file = f"{CUBE_FILE}.{os.getpid()}.tmp"
+    with open(tmp_file, "wb") as f:
+        np.savez_compressed(f, cube=cube, version=version)
+    os.replace(tmp_file, CUBE_FILE)
+    return cube
+
+
+allocation_cube = load_allocation_cube()
+
+
+def portfolio_growth(stocks, cash):
+    """cumulative growth of $1 for each year in df with annual rebalancing"""
+    if stocks % ALLOCATION_STEP == 0 and cash % ALLOCATION_STEP == 0:
+        return allocation_cube[cash // ALLOCATION_STEP, stocks // ALLOCATION_STEP]
+
+    # allocation isn't on the slider grid, so calculate it
+    allocation = np.array([cash, 100 - stocks - cash, stocks]) / 100
+    growth = 1 + df[["3-mon T.Bill", "10yr T.Bond", "S&P 500"]].to_numpy()
+    return np.cumprod(growth @ allocation)
+
+
+def growth_between(stocks, cash, nper, start_yr):
+    """growth of $1 from the start of start_yr over nper years - O(1) cube lookup"""
+    path = portfolio_growth(stocks, cash)
+    first = start_yr - MIN_YR
+    return path[first + nper] / path[first]
+
+
+"""
+==========================================================================
+Index of the annual returns for benchmark paths, cagr and worst periods
+"""
+
+# Built once from df.  The growth of each asset over any period is the ratio of
+# two prefix products, and a sparse table finds the worst year in any period
+# by comparing two precomputed windows.
+RETURN_COLUMNS = ["3-mon T.Bill", "10yr T.Bond", "S&P 500", "Inflation"]
+BENCHMARK_COLUMNS = ["all_cash", "all_bonds", "all_stocks", "inflation_only"]
+
+annual_returns = df[RETURN_COLUMNS].to_numpy()
+cumulative_growth = np.cumprod(1 + annual_returns, axis=0)
+
+
+def build_sparse_table(values):
+    """level k holds the row of the minimum value in each window of 2**k rows"""
+    rows = np.arange(len(values))[:, np.newaxis]
+    table = [np.repeat(rows, values.shape[1], axis=1)]
+    width = 1
+    while 2 * width <= len(values):
+        left = table[-1][:-width]
+        right = table[-1][width:]
+        # on a tie keep the earlier year
+        right_is_lower = np.take_along_axis(values, right, 0) < np.take_along_axis(
+            values, left, 0
+        )
+        table.append(np.where(right_is_lower, right, left))
+        width *= 2
+    return table
+
+
+worst_year_table = build_sparse_table(annual_returns)
+
+
+def year_row(yr):
+    """row number in df for a year"""
+    return int(yr - MIN_YR + 1)
+
+
+def benchmark_paths(start_bal, start_yr, end_yr):
+    """balances from year[0] to end_yr for all cash, all bonds, all stocks and
+    inflation - one row per year, one column per BENCHMARK_COLUMNS
+    """
+    window = cumulative_growth[year_row(start_yr) - 1 : year_row(end_yr) + 1]
+    return np.round(start_bal * window / window[0], 0)
+
+
 """
 ==========================================================================
 Helper functions to calculate investment results, cagr and worst periods
@@ -483,80 +703,67 @@ def backtest(stocks, cash, start_bal, nper, start_yr):
     cash_allocation = cash / 100
     stocks_allocation = stocks / 100
     bonds_allocation = (100 - stocks - cash) / 100
+    allocation = np.array([cash_allocation, bonds_allocation, stocks_allocation])
 
     # Select time period - since data is for year end, include year prior
     # for start ie year[0]
-    dff = df[(df.Year >= start_yr - 1) & (df.Year <= end_yr)].set_index(
-        "Year", drop=False
-    )
+    dff = df[(df.Year >= start_yr - 1) & (df.Year <= end_yr)].reset_index(drop=True)
     dff["Year"] = dff["Year"].astype(int)
 
-    # add columns for My Portfolio returns
-    dff["Cash"] = cash_allocation * start_bal
-    dff["Bonds"] = bonds_allocation * start_bal
-    dff["Stocks"] = stocks_allocation * start_bal
-    dff["Total"] = start_bal
-    dff["Rebalance"] = True
+    # growth factors for cash, bonds and stocks.  There are no returns in year[0]
+    growth = 1 + dff[["3-mon T.Bill", "10yr T.Bond", "S&P 500"]].to_numpy()
+    growth[0] = 1
 
     # calculate My Portfolio returns
-    for yr in dff.Year + 1:
-        if yr <= end_yr:
-            # Rebalance at the beginning of the period by reallocating
-            # last period's total ending balance
-            if dff.loc[yr, "Rebalance"]:
-                dff.loc[yr, "Cash"] = dff.loc[yr - 1, "Total"] * cash_allocation
-                dff.loc[yr, "Stocks"] = dff.loc[yr - 1, "Total"] * stocks_allocation
-                dff.loc[yr, "Bonds"] = dff.loc[yr - 1, "Total"] * bonds_allocation
-
-            # calculate this period's  returns
-            dff.loc[yr, "Cash"] = dff.loc[yr, "Cash"] * (
-                1 + dff.loc[yr, "3-mon T.Bill"]
-            )
-            dff.loc[yr, "Stocks"] = dff.loc[yr, "Stocks"] * (1 + dff.loc[yr, "S&P 500"])
-            dff.loc[yr, "Bonds"] = dff.loc[yr, "Bonds"] * (
-                1 + dff.loc[yr, "10yr T.Bond"]
-            )
-            dff.loc[yr, "Total"] = dff.loc[yr, ["Cash", "Bonds", "Stocks"]].sum()
-
-    dff = dff.reset_index(drop=True)
+    # Rebalancing at the beginning of every period means the total grows by the
+    # allocation weighted return each year, so the totals are a slice of the
+    # precomputed cumulative growth for this allocation.
+    first = start_yr - MIN_YR
+    path = portfolio_growth(stocks, cash)[first : first + nper + 1]
+    total = start_bal * path / path[0]
+    prior_total = np.concatenate(([start_bal], total[:-1]))
+    holdings = prior_total[:, np.newaxis] * allocation * growth
+
+    dff["Cash"] = holdings[:, 0]
+    dff["Bonds"] = holdings[:, 1]
+    dff["Stocks"] = holdings[:, 2]
+    dff["Total"] = total
     columns = ["Cash", "Stocks", "Bonds", "Total"]
     dff[columns] = dff[columns].round(0)
 
     # create columns for when portfolio is all cash, all bonds or  all stocks,
     #   include inflation too
-    #
-    # create new df that starts in yr 1 rather than yr 0
-    dff1 = (dff[(dff.Year >= start_yr) & (dff.Year <= end_yr)]).copy()
-    #
-    # calculate the returns in new df:
-    columns = ["all_cash", "all_bonds", "all_stocks", "inflation_only"]
-    annual_returns = ["3-mon T.Bill", "10yr T.Bond", "S&P 500", "Inflation"]
-    for col, return_pct in zip(columns, annual_returns):
-        dff1[col] = round(start_bal * (1 + (1 + dff1[return_pct]).cumprod() - 1), 0)
-    #
-    # select columns in the new df to merge with original
-    dff1 = dff1[["Year"] + columns]
-    dff = dff.merge(dff1, how="left")
-    # fill in the starting balance for year[0]
-    dff.loc[0, columns] = start_bal
+    dff[BENCHMARK_COLUMNS] = benchmark_paths(start_bal, start_yr, end_yr)
     return dff
 
 
-def cagr(dff):
-    """calculate Compound Annual Growth Rate for a series and returns a formated string"""
+def cagr(asset, start_yr, end_yr):
+    """calculate Compound Annual Growth Rate for an asset from the beginning of
+    start_yr to the end of end_yr and returns a formated string
+    """
 
-    start_bal = dff.iat[0]
-    end_bal = dff.iat[-1]
-    planning_time = len(dff) - 1
-    cagr_result = ((end_bal / start_bal) ** (1 / planning_time)) - 1
+    col = RETURN_COLUMNS.index(asset)
+    growth = (
+        cumulative_growth[year_row(end_yr), col]
+        / cumulative_growth[year_row(start_yr) - 1, col]
+    )
+    planning_time = end_yr - start_yr + 1
+    cagr_result = (growth ** (1 / planning_time)) - 1
     return f"{cagr_result:.1%}"
 
 
-def worst(dff, asset):
+def worst(asset, start_yr, end_yr):
     """calculate worst returns for asset in selected period returns formated string"""
 
-    worst_yr_loss = min(dff[asset])
-    worst_yr = dff.loc[dff[asset] == worst_yr_loss, "Year"].iloc[0]
+    col = RETURN_COLUMNS.index(asset)
+    first, last = year_row(start_yr), year_row(end_yr)
+    level = (last - first + 1).bit_length() - 1
+    left = worst_year_table[level][first, col]
+    right = worst_year_table[level][last - 2**level + 1, col]
+    row = right if annual_returns[right, col] < annual_returns[left, col] else left
+
+    worst_yr_loss = annual_returns[row, col]
+    worst_yr = MIN_YR - 1 + row
     return f"{worst_yr_loss:.1%} in {worst_yr}"
 
 
@@ -594,6 +801,8 @@ app.layout = dbc.Container(
             className="ms-1",
         ),
         dbc.Row(dbc.Col(footer)),
+        # inputs for the returns currently shown in the browser
+        dcc.Store(id="returns_shown"),
     ],
     fluid=True,
 )
@@ -620,7 +829,10 @@ def update_pie(stocks, cash):
         investment_style = "Conservative"
     else:
         investment_style = "Moderate"
-    figure = make_pie(slider_input, investment_style + " Asset Allocation")
+    figure = figure_cache.get(
+        ("pie", cash, stocks),
+        lambda: make_pie(slider_input, investment_style + " Asset Allocation"),
+    )
     return figure
 
 
@@ -674,13 +886,15 @@ def update_time_period(planning_time, start_yr, period_number):
     Output("summary_table", "children"),
     Output("ending_amount", "value"),
     Output("cagr", "value"),
+    Output("returns_shown", "data"),
     Input("stock_bond", "value"),
     Input("cash", "value"),
     Input("starting_amount", "value"),
     Input("planning_time", "value"),
     Input("start_yr", "value"),
+    State("returns_shown", "data"),
 )
-def update_totals(stocks, cash, start_bal, planning_time, start_yr):
+def update_totals(stocks, cash, start_bal, planning_time, start_yr, shown):
     # set defaults for invalid inputs
     start_bal = 10 if start_bal is None else start_bal
     planning_time = 1 if planning_time is None else planning_time
@@ -690,26 +904,53 @@ def update_totals(stocks, cash, start_bal, planning_time, start_yr):
     max_time = MAX_YR + 1 - start_yr
     planning_time = min(max_time, planning_time)
     if start_yr + planning_time > MAX_YR:
-        start_yr = min(df.iloc[-planning_time, 0], MAX_YR)  # 0 is Year column
+        start_yr = int(min(df.iloc[-planning_time, 0], MAX_YR))  # 0 is Year column
 
     # create investment returns dataframe
     dff = backtest(stocks, cash, start_bal, planning_time, start_yr)
+    inputs = dict(
+        stocks=stocks,
+        cash=cash,
+        start_bal=start_bal,
+        planning_time=planning_time,
+        start_yr=start_yr,
+    )
 
-    # create data for DataTable
-    data = dff.to_dict("records")
-
-    # create the line chart
-    fig = make_line_chart(dff)
+    if (
+        shown
+        and shown["start_yr"] == start_yr
+        and shown["planning_time"] == planning_time
+    ):
+        # Same years as the browser already has, so only the allocation or the
+        # starting amount changed.  Send just the values that are different.
+        shown_dff = backtest(
+            shown["stocks"],
+            shown["cash"],
+            shown["start_bal"],
+            shown["planning_time"],
+            shown["start_yr"],
+        )
+        data, fig = make_returns_patch(dff, shown_dff)
+        # the summary only depends on the years
+        summary_table = no_update
+    else:
+        # create data for DataTable - only the columns it shows
+        data = dff[TABLE_COLUMNS].to_dict("records")
 
-    summary_table = make_summary_table(dff)
+        # create the line chart, or reuse it if these inputs were seen before
+        fig = figure_cache.get(
+            ("line", stocks, cash, start_bal, planning_time, start_yr),
+            lambda: make_line_chart(dff),
+        )
 
-    # format ending balance
-    ending_amount = f"${dff['Total'].iloc[-1]:0,.0f}"
+        summary_table = make_summary_table(dff)
 
-    # calcluate cagr
-    ending_cagr = cagr(dff["Total"])
+    # ending balance and cagr are looked up from the precomputed growth
+    growth = growth_between(stocks, cash, planning_time, start_yr)
+    ending_amount = f"${start_bal * growth:0,.0f}"
+    ending_cagr = f"{growth ** (1 / planning_time) - 1:.1%}"
 
-    return data, fig, summary_table, ending_amount, ending_cagr
+    return data, fig, summary_table, ending_amount, ending_cagr, inputs
 
 
 if __name__ == "__main__":
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""
+Compares the NumPy backtest() in app.py with the original per-year .loc loop
+for every planning period from 1 to the full length of the data.
+
+Run from the Chapter-6 folder:
+    python benchmark_backtest.py
+"""
+
+import timeit
+
+import pandas as pd
+
+from app import df, backtest, MIN_YR, MAX_YR
+
+
+def backtest_loop(stocks, cash, start_bal, nper, start_yr):
+    """original backtest - rebalances year by year with scalar .loc lookups"""
+
+    end_yr = start_yr + nper - 1
+    cash_allocation = cash / 100
+    stocks_allocation = stocks / 100
+    bonds_allocation = (100 - stocks - cash) / 100
+
+    dff = df[(df.Year >= start_yr - 1) & (df.Year <= end_yr)].set_index(
+        "Year", drop=False
+    )
+    dff["Year"] = dff["Year"].astype(int)
+
+    dff["Cash"] = cash_allocation * start_bal
+    dff["Bonds"] = bonds_allocation * start_bal
+    dff["Stocks"] = stocks_allocation * start_bal
+    dff["Total"] = start_bal
+    dff["Rebalance"] = True
+
+    for yr in dff.Year + 1:
+        if yr <= end_yr:
+            if dff.loc[yr, "Rebalance"]:
+                dff.loc[yr, "Cash"] = dff.loc[yr - 1, "Total"] * cash_allocation
+                dff.loc[yr, "Stocks"] = dff.loc[yr - 1, "Total"] * stocks_allocation
+                dff.loc[yr, "Bonds"] = dff.loc[yr - 1, "Total"] * bonds_allocation
+
+            dff.loc[yr, "Cash"] = dff.loc[yr, "Cash"] * (
+                1 + dff.loc[yr, "3-mon T.Bill"]
+            )
+            dff.loc[yr, "Stocks"] = dff.loc[yr, "Stocks"] * (1 + dff.loc[yr, "S&P 500"])
+            dff.loc[yr, "Bonds"] = dff.loc[yr, "Bonds"] * (
+                1 + dff.loc[yr, "10yr T.Bond"]
+            )
+            dff.loc[yr, "Total"] = dff.loc[yr, ["Cash", "Bonds", "Stocks"]].sum()
+
+    dff = dff.reset_index(drop=True)
+    columns = ["Cash", "Stocks", "Bonds", "Total"]
+    dff[columns] = dff[columns].round(0)
+
+    dff1 = (dff[(dff.Year >= start_yr) & (dff.Year <= end_yr)]).copy()
+    columns = ["all_cash", "all_bonds", "all_stocks", "inflation_only"]
+    annual_returns = ["3-mon T.Bill", "10yr T.Bond", "S&P 500", "Inflation"]
+    for col, return_pct in zip(columns, annual_returns):
+        dff1[col] = round(start_bal * (1 + (1 + dff1[return_pct]).cumprod() - 1), 0)
+    dff1 = dff1[["Year"] + columns]
+    dff = dff.merge(dff1, how="left")
+    dff.loc[0, columns] = start_bal
+    return dff.drop(columns="Rebalance")
+
+
+def main(stocks=50, cash=10, start_bal=10000, repeat=3):
+    print(f"{'years':>5} {'loop ms':>10} {'numpy ms':>10} {'speedup':>8}")
+    total_loop = total_numpy = 0
+    for nper in range(1, MAX_YR - MIN_YR + 2):
+        start_yr = MAX_YR - nper + 1
+        args = (stocks, cash, start_bal, nper, start_yr)
+
+        # the cumulative product and the loop add up in a different order, so a
+        # balance that lands on half a dollar may round the other way
+        pd.testing.assert_frame_equal(
+            backtest(*args), backtest_loop(*args), check_dtype=False, rtol=0, atol=1
+        )
+
+        loop = min(timeit.repeat(lambda: backtest_loop(*args), number=1, repeat=repeat))
+        numpy = min(timeit.repeat(lambda: backtest(*args), number=1, repeat=repeat))
+        total_loop += loop
+        total_numpy += numpy
+        print(
+            f"{nper:>5} {loop * 1000:>10.2f} {numpy * 1000:>10.2f} {loop / numpy:>7.1f}x"
+        )
+
+    print(
+        f"{'all':>5} {total_loop * 1000:>10.2f} {total_numpy * 1000:>10.2f}"
+        f" {total_loop / total_numpy:>7.1f}x"
+    )
+
+
+if __name__ == "__main__":
+    main()
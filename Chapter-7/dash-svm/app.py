@@ -1,55 +1,71 @@
-import time
 import importlib
+import os
+import time
 
-from dash import Dash, dcc, html, Input, Output, State
+from dash import (
+    Dash,
+    DiskcacheManager,
+    dcc,
+    html,
+    Input,
+    Output,
+    State,
+    Patch,
+    no_update,
+)
+from dash.exceptions import PreventUpdate
+import diskcache
 import numpy as np
-from sklearn.model_selection import train_test_split
-from sklearn.preprocessing import StandardScaler
-from sklearn import datasets
-from sklearn.svm import SVC
 
 import utils.dash_reusable_components as drc
 import utils.figures as figs
+from utils.approximate import N_COMPONENTS
+from utils.landscape import axes, compute_landscape, landscape_key, landscape_store
+from utils.models import (
+    CACHE_DIR,
+    get_model,
+    is_trained,
+    kernel_store,
+    model_cache,
+    model_key,
+    model_store,
+)
+
+# Training runs as a background job in its own process, with the jobs kept in
+# an SQLite database on local disk. When the parameters change while a job is
+# running, the browser has it stopped and starts a new one, so only the latest
+# parameters of each page are trained
+background_callback_manager = DiskcacheManager(
+    diskcache.Cache(os.path.join(CACHE_DIR, "jobs"))
+)
+DEBOUNCE = 0.3  # seconds a job waits before training, in case it is replaced
+JOB_INTERVAL = 200  # milliseconds between the browser's checks on a job
+
+# the sizes on the sample size slider, approximated above APPROXIMATE_ABOVE
+SAMPLE_SIZES = [100, 200, 300, 400, 500, 1000, 10_000, 100_000, 1_000_000]
+SAMPLE_SIZE_MARKS = ["100", "200", "300", "400", "500", "1k", "10k", "100k", "1M"]
 
 app = Dash(
     __name__,
     meta_tags=[
         {"name": "viewport", "content": "width=device-width, initial-scale=1.0"}
     ],
+    background_callback_manager=background_callback_manager,
 )
 app.title = "Support Vector Machine"
 server = app.server
 
 
-def generate_data(n_samples, dataset, noise):
-    if dataset == "moons":
-        return datasets.make_moons(n_samples=n_samples, noise=noise, random_state=0)
-
-    elif dataset == "circles":
-        return datasets.make_circles(
-            n_samples=n_samples, noise=noise, factor=0.5, random_state=1
-        )
-
-    elif dataset == "linear":
-        X, y = datasets.make_classification(
-            n_samples=n_samples,
-            n_features=2,
-            n_redundant=0,
-            n_informative=2,
-            random_state=2,
-            n_clusters_per_class=1,
-        )
-
-        rng = np.random.RandomState(2)
-        X += noise * rng.uniform(size=X.shape)
-        linearly_separable = (X, y)
-
-        return linearly_separable
-
-    else:
-        raise ValueError(
-            "Data type incorrectly specified. Please choose an existing dataset."
-        )
+@server.route("/model-cache-stats")
+def model_cache_stats():
+    return {
+        "models": model_cache.stats(),
+        "kernels": dict(
+            zip(["hits", "misses"], kernel_store.stats()), size=len(kernel_store)
+        ),
+        "stored models": len(model_store),
+        "stored landscapes": len(landscape_store),
+    }
 
 
 app.layout = html.Div(
@@ -123,14 +139,11 @@ app.layout = html.Div(
                                         drc.NamedSlider(
                                             name="Sample Size",
                                             id="slider-dataset-sample-size",
-                                            min=100,
-                                            max=500,
-                                            step=100,
-                                            marks={
-                                                str(i): str(i)
-                                                for i in [100, 200, 300, 400, 500]
-                                            },
-                                            value=300,
+                                            min=0,
+                                            max=len(SAMPLE_SIZES) - 1,
+                                            step=1,
+                                            marks=dict(enumerate(SAMPLE_SIZE_MARKS)),
+                                            value=SAMPLE_SIZES.index(300),
                                         ),
                                         drc.NamedSlider(
                                             name="Noise Level",
@@ -144,6 +157,7 @@ app.layout = html.Div(
                                             step=0.1,
                                             value=0.2,
                                         ),
+                                        html.P(id="approximation-report"),
                                     ],
                                 ),
                                 drc.Card(
@@ -161,6 +175,22 @@ app.layout = html.Div(
                                             "Reset Threshold",
                                             id="button-zero-threshold",
                                         ),
+                                        drc.NamedRadioItems(
+                                            name="Threshold Line",
+                                            id="radio-threshold-line",
+                                            labelStyle={
+                                                "margin-right": "7px",
+                                                "display": "inline-block",
+                                            },
+                                            options=[
+                                                {
+                                                    "label": " Progressive",
+                                                    "value": "progressive",
+                                                },
+                                                {"label": " Fine", "value": "fine"},
+                                            ],
+                                            value="progressive",
+                                        ),
                                     ],
                                 ),
                                 drc.Card(
@@ -233,6 +263,10 @@ app.layout = html.Div(
                                             max=9,
                                             value=5,
                                         ),
+                                        html.Button(
+                                            "Evaluate All C and Gamma",
+                                            id="button-landscape",
+                                        ),
                                         html.Div(
                                             id="shrinking-container",
                                             children=[
@@ -263,15 +297,52 @@ app.layout = html.Div(
                         ),
                         html.Div(
                             id="div-graphs",
-                            children=dcc.Graph(
-                                id="graph-sklearn-svm",
-                                figure=dict(
-                                    layout=dict(
-                                        plot_bgcolor="#282b38", paper_bgcolor="#282b38"
-                                    )
+                            children=[
+                                html.Div(
+                                    id="svm-graph-container",
+                                    children=dcc.Loading(
+                                        className="graph-wrapper",
+                                        children=dcc.Graph(
+                                            id="graph-sklearn-svm",
+                                            figure=dict(
+                                                layout=dict(
+                                                    plot_bgcolor="#282b38",
+                                                    paper_bgcolor="#282b38",
+                                                )
+                                            ),
+                                        ),
+                                        style={"display": "none"},
+                                    ),
+                                ),
+                                html.Div(
+                                    id="graphs-container",
+                                    children=[
+                                        dcc.Loading(
+                                            className="graph-wrapper",
+                                            children=dcc.Graph(
+                                                id="graph-line-roc-curve"
+                                            ),
+                                        ),
+                                        dcc.Loading(
+                                            className="graph-wrapper",
+                                            children=dcc.Graph(
+                                                id="graph-pie-confusion-matrix"
+                                            ),
+                                        ),
+                                        # not dcc.Loading, which would cover the
+                                        # cells as they stream in
+                                        html.Div(
+                                            className="graph-wrapper",
+                                            children=dcc.Graph(id="graph-landscape"),
+                                        ),
+                                    ],
                                 ),
-                            ),
+                            ],
                         ),
+                        # parameters of the trained model, which is kept on the
+                        # server in the model cache
+                        dcc.Store(id="model-params"),
+                        dcc.Store(id="threshold-line-request"),
                     ],
                 )
             ],
@@ -338,7 +409,7 @@ def disable_slider_param_gamma_power(kernel):
 
 
 @app.callback(
-    Output("div-graphs", "children"),
+    Output("model-params", "data"),
     [
         Input("dropdown-svm-parameter-kernel", "value"),
         Input("slider-svm-parameter-degree", "value"),
@@ -349,11 +420,13 @@ def disable_slider_param_gamma_power(kernel):
         Input("dropdown-select-dataset", "value"),
         Input("slider-dataset-noise-level", "value"),
         Input("radio-svm-parameter-shrinking", "value"),
-        Input("slider-threshold", "value"),
         Input("slider-dataset-sample-size", "value"),
     ],
+    [State("model-params", "data")],
+    background=True,
+    interval=JOB_INTERVAL,
 )
-def update_svm_graph(
+def update_model(
     kernel,
     degree,
     C_coef,
@@ -363,25 +436,10 @@ def update_svm_graph(
     dataset,
     noise,
     shrinking,
-    threshold,
-    sample_size,
+    sample_size_index,
+    current_params,
 ):
-    t_start = time.time()
-    h = 0.3  # step size in the mesh
-
-    # Data Pre-processing
-    X, y = generate_data(n_samples=sample_size, dataset=dataset, noise=noise)
-    X = StandardScaler().fit_transform(X)
-    X_train, X_test, y_train, y_test = train_test_split(
-        X, y, test_size=0.4, random_state=42
-    )
-
-    x_min = X[:, 0].min() - 0.5
-    x_max = X[:, 0].max() + 0.5
-    y_min = X[:, 1].min() - 0.5
-    y_max = X[:, 1].max() + 0.5
-    xx, yy = np.meshgrid(np.arange(x_min, x_max, h), np.arange(y_min, y_max, h))
-
+    sample_size = SAMPLE_SIZES[sample_size_index]
     C = C_coef * 10 ** C_power
     gamma = gamma_coef * 10 ** gamma_power
 
@@ -390,61 +448,184 @@ def update_svm_graph(
     else:
         flag = False
 
-    # Train SVM
-    clf = SVC(C=C, kernel=kernel, degree=degree, gamma=gamma, shrinking=flag)
-    clf.fit(X_train, y_train)
+    params = dict(
+        kernel=kernel,
+        degree=degree,
+        C=C,
+        gamma=gamma,
+        shrinking=flag,
+        dataset=dataset,
+        noise=noise,
+        sample_size=sample_size,
+    )
+    if current_params and model_key(**current_params) == model_key(**params):
+        # e.g. a slider the kernel doesn't use - the figures stay as they are
+        raise PreventUpdate
 
-    # Plot the decision boundary. For that, we will assign a color to each
-    # point in the mesh [x_min, x_max]x[y_min, y_max].
-    if hasattr(clf, "decision_function"):
-        Z = clf.decision_function(np.c_[xx.ravel(), yy.ravel()])
-    else:
-        Z = clf.predict_proba(np.c_[xx.ravel(), yy.ravel()])[:, 1]
-
-    prediction_figure = figs.serve_prediction_plot(
-        model=clf,
-        X_train=X_train,
-        X_test=X_test,
-        y_train=y_train,
-        y_test=y_test,
-        Z=Z,
-        xx=xx,
-        yy=yy,
-        mesh_step=h,
-        threshold=threshold,
+    if not is_trained(**params):
+        # while a slider moves, jobs for the values it passes are stopped here
+        time.sleep(DEBOUNCE)
+
+    # Train SVM now, so the figure callbacks find it in the model store
+    get_model(**params)
+    return params
+
+
+@app.callback(
+    [
+        Output("graph-sklearn-svm", "figure"),
+        Output("threshold-line-request", "data"),
+    ],
+    [
+        Input("model-params", "data"),
+        Input("slider-threshold", "value"),
+        Input("radio-threshold-line", "value"),
+    ],
+)
+def update_prediction_plot(params, threshold, line_detail):
+    if params is None:
+        raise PreventUpdate
+    trained = get_model(**params)
+
+    # In progressive mode the threshold line is first traced on the coarse
+    # mesh, and refine_threshold_line() replaces it with the fine one
+    progressive = line_detail == "progressive"
+    scaled_threshold = figs.scale_threshold(trained["context"], threshold)
+    line = trained["mesh"].threshold_line(scaled_threshold, fine=not progressive)
+
+    figure = figs.serve_prediction_plot(
+        context=trained["context"], threshold=threshold, line=line
     )
+    if progressive:
+        return figure, dict(params=params, threshold=threshold)
+    return figure, no_update
+
+
+@app.callback(
+    Output("graph-sklearn-svm", "figure", allow_duplicate=True),
+    [Input("threshold-line-request", "data")],
+    [State("model-params", "data"), State("slider-threshold", "value")],
+    prevent_initial_call=True,
+)
+def refine_threshold_line(request, params, threshold):
+    if request["params"] != params or request["threshold"] != threshold:
+        # the coarse line is already out of date
+        raise PreventUpdate
+    trained = get_model(**params)
+
+    scaled_threshold = figs.scale_threshold(trained["context"], threshold)
+    line = trained["mesh"].threshold_line(scaled_threshold)
+
+    # only send the new line
+    figure = Patch()
+    figure["data"][1] = figs.serve_threshold_line(line, scaled_threshold)
+    return figure
+
+
+@app.callback(Output("graph-line-roc-curve", "figure"), [Input("model-params", "data")])
+def update_roc_curve(params):
+    if params is None:
+        raise PreventUpdate
+    trained = get_model(**params)
+
+    return figs.serve_roc_curve(context=trained["context"])
 
-    roc_figure = figs.serve_roc_curve(model=clf, X_test=X_test, y_test=y_test)
 
-    confusion_figure = figs.serve_pie_confusion_matrix(
-        model=clf, X_test=X_test, y_test=y_test, Z=Z, threshold=threshold
+@app.callback(
+    Output("graph-pie-confusion-matrix", "figure"),
+    [Input("model-params", "data"), Input("slider-threshold", "value")],
+)
+def update_pie_confusion_matrix(params, threshold):
+    if params is None:
+        raise PreventUpdate
+    trained = get_model(**params)
+
+    return figs.serve_pie_confusion_matrix(
+        context=trained["context"], threshold=threshold
     )
 
-    return [
-        html.Div(
-            id="svm-graph-container",
-            children=dcc.Loading(
-                className="graph-wrapper",
-                children=dcc.Graph(id="graph-sklearn-svm", figure=prediction_figure),
-                style={"display": "none"},
-            ),
-        ),
-        html.Div(
-            id="graphs-container",
-            children=[
-                dcc.Loading(
-                    className="graph-wrapper",
-                    children=dcc.Graph(id="graph-line-roc-curve", figure=roc_figure),
-                ),
-                dcc.Loading(
-                    className="graph-wrapper",
-                    children=dcc.Graph(
-                        id="graph-pie-confusion-matrix", figure=confusion_figure
-                    ),
-                ),
-            ],
+
+@app.callback(
+    Output("approximation-report", "children"), [Input("model-params", "data")]
+)
+def update_approximation_report(params):
+    if params is None:
+        raise PreventUpdate
+    approximation = get_model(**params)["approximation"]
+    if approximation is None:
+        return None
+
+    return (
+        f"Approximated with a linear SVM on {N_COMPONENTS} Nyström features. "
+        f"Test accuracy {approximation['approximate']:.3f}, against "
+        f"{approximation['exact']:.3f} for the exact SVM trained on "
+        f"{approximation['samples']:,} samples (gap {approximation['gap']:+.3f})."
+    )
+
+
+LANDSCAPE_INPUTS = [
+    Input("dropdown-svm-parameter-kernel", "value"),
+    Input("slider-svm-parameter-degree", "value"),
+    Input("slider-svm-parameter-C-coef", "value"),
+    Input("slider-svm-parameter-gamma-coef", "value"),
+    Input("dropdown-select-dataset", "value"),
+    Input("slider-dataset-noise-level", "value"),
+    Input("radio-svm-parameter-shrinking", "value"),
+    Input("slider-dataset-sample-size", "value"),
+]
+
+
+def landscape_params(
+    kernel, degree, C_coef, gamma_coef, dataset, noise, shrinking, sample_size_index
+):
+    return dict(
+        kernel=kernel,
+        degree=degree,
+        C_coef=C_coef,
+        gamma_coef=gamma_coef,
+        shrinking=shrinking == "True",
+        dataset=dataset,
+        noise=noise,
+        sample_size=SAMPLE_SIZES[sample_size_index],
+    )
+
+
+@app.callback(Output("graph-landscape", "figure"), LANDSCAPE_INPUTS)
+def show_landscape(*values):
+    params = landscape_params(*values)
+    C_values, gamma_values = axes(params["C_coef"], params["gamma_coef"])
+
+    accuracy = landscape_store.get(landscape_key(**params))
+    if accuracy is None:
+        # it trains a model for every cell, so only when the button asks for it
+        accuracy = np.full((len(gamma_values), len(C_values)), np.nan)
+    return figs.serve_landscape(C_values, gamma_values, accuracy)
+
+
+@app.callback(
+    Output("graph-landscape", "figure", allow_duplicate=True),
+    [Input("button-landscape", "n_clicks")],
+    [State(i.component_id, i.component_property) for i in LANDSCAPE_INPUTS],
+    background=True,
+    interval=JOB_INTERVAL,
+    progress=Output("graph-landscape", "figure", allow_duplicate=True),
+    # a landscape of other parameters would be out of date - the power
+    # sliders aren't among them, so moving them doesn't stop the job
+    cancel=LANDSCAPE_INPUTS,
+    prevent_initial_call=True,
+)
+def update_landscape(set_progress, n_clicks, *values):
+    params = landscape_params(*values)
+    C_values, gamma_values = axes(params["C_coef"], params["gamma_coef"])
+
+    # The cells are streamed to the heatmap as they finish
+    accuracy = compute_landscape(
+        **params,
+        on_cell=lambda accuracy: set_progress(
+            figs.serve_landscape(C_values, gamma_values, accuracy)
         ),
-    ]
+    )
+    return figs.serve_landscape(C_values, gamma_values, accuracy)
 
 
 # Running the server
@@ -0,0 +1,85 @@
+"""
+Times training the exact SVC and the ApproximateSVM the app switches to above
+APPROXIMATE_ABOVE samples, and evaluating each on the mesh of the app at its
+finest, for growing samples of the moons dataset.  The exact SVC is only timed
+up to EXACT_MAX samples - its fit time grows with the square of the samples, to
+many minutes for a million.  The accuracy gap is the one the app reports,
+against the exact SVC trained on a subsample.
+
+Run from the dash-svm folder:
+    python benchmark_approximation.py
+"""
+import timeit
+
+import numpy as np
+from sklearn.model_selection import train_test_split
+from sklearn.preprocessing import StandardScaler
+from sklearn.svm import SVC
+
+from utils.approximate import ApproximateSVM, compare_to_exact
+from utils.mesh import REFINE, evaluate_points
+from utils.models import MESH_STEP, generate_data, kernel_params
+
+SAMPLE_SIZES = [500, 1000, 5000, 10_000, 20_000, 100_000, 1_000_000]
+EXACT_MAX = 100_000
+
+
+def fine_mesh(X):
+    """the points of the mesh of the app, refined everywhere"""
+    step = MESH_STEP / REFINE
+    x = np.arange(X[:, 0].min() - 0.5, X[:, 0].max() + 0.5, step)
+    y = np.arange(X[:, 1].min() - 0.5, X[:, 1].max() + 0.5, step)
+    xx, yy = np.meshgrid(x, y)
+    return xx.ravel(), yy.ravel()
+
+
+def timed(function):
+    """returns what function() returns and the seconds it took"""
+    start = timeit.default_timer()
+    result = function()
+    return result, timeit.default_timer() - start
+
+
+def main(kernel="rbf", degree=3, C=1, gamma=0.5):
+    params = kernel_params(kernel, degree, gamma)
+    print(
+        f"{'samples':>9} {'mesh':>7} {'exact fit s':>11} {'mesh ms':>8}"
+        f" {'approx fit s':>12} {'mesh ms':>8} {'gap':>7}"
+    )
+    for sample_size in SAMPLE_SIZES:
+        X, y = generate_data(n_samples=sample_size, dataset="moons", noise=0.2)
+        X = StandardScaler().fit_transform(X)
+        X_train, X_test, y_train, y_test = train_test_split(
+            X, y, test_size=0.4, random_state=42
+        )
+        mesh_x, mesh_y = fine_mesh(X)
+
+        if sample_size <= EXACT_MAX:
+            exact, exact_fit = timed(
+                lambda: SVC(C=C, kernel=kernel, **params).fit(X_train, y_train)
+            )
+            _, exact_mesh = timed(
+                lambda: evaluate_points(exact.decision_function, mesh_x, mesh_y)
+            )
+            exact_columns = f"{exact_fit:>11.3f} {exact_mesh * 1000:>8.1f}"
+        else:
+            exact_columns = f"{'-':>11} {'-':>8}"
+
+        approximate, approximate_fit = timed(
+            lambda: ApproximateSVM(kernel, params, C).fit(X_train, y_train)
+        )
+        _, approximate_mesh = timed(
+            lambda: evaluate_points(approximate.decision_function, mesh_x, mesh_y)
+        )
+        comparison = compare_to_exact(
+            approximate, X_train, X_test, y_train, y_test, kernel, params, C, True
+        )
+        print(
+            f"{sample_size:>9} {len(mesh_x):>7} {exact_columns}"
+            f" {approximate_fit:>12.3f} {approximate_mesh * 1000:>8.1f}"
+            f" {comparison['gap']:>+7.3f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
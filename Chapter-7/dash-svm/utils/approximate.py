@@ -0,0 +1,93 @@
+import numpy as np
+from sklearn.kernel_approximation import Nystroem
+from sklearn.linear_model import SGDClassifier
+from sklearn.metrics.pairwise import pairwise_kernels
+from sklearn.svm import SVC
+
+from utils.mesh import CHUNK_SIZE, evaluate_points
+
+N_COMPONENTS = 100  # Nyström features, enough for the two dimensional datasets
+EXACT_SUBSAMPLE = 2000  # samples of the exact SVM the approximation is compared to
+
+
+class ApproximateSVM:
+    """An SVM for datasets too large for SVC: the kernel is approximated with
+    Nyström features of N_COMPONENTS samples, and a linear SVM is trained on
+    them with averaged stochastic gradient descent.
+
+    The features are computed CHUNK_SIZE samples at a time, and the SVM sees
+    each chunk once, so memory doesn't grow with the number of samples and the
+    time only grows linearly with it.
+    """
+
+    def __init__(self, kernel, params, C, n_components=N_COMPONENTS, seed=0):
+        self.kernel = kernel
+        self.params = params
+        self.features = Nystroem(
+            kernel=kernel, n_components=n_components, random_state=seed, **params
+        )
+        self.C = C
+        self.seed = seed
+
+    def fit(self, X, y, chunk_size=CHUNK_SIZE):
+        self.features.fit(X)
+        # the same objective as SVC: alpha is the weight of the margin against
+        # the mean of the hinge loss, where C weighs the sum of the hinge loss
+        self.svm = SGDClassifier(
+            loss="hinge",
+            alpha=1 / (self.C * len(X)),
+            average=True,
+            random_state=self.seed,
+        )
+        rng = np.random.default_rng(self.seed)
+        for start in rng.permutation(np.arange(0, len(X), chunk_size)):
+            chunk = slice(start, start + chunk_size)
+            self.svm.partial_fit(
+                self.features.transform(X[chunk]), y[chunk], classes=[0, 1]
+            )
+
+        # The features are the kernel against the Nyström samples times a
+        # normalization matrix, which is folded into the weights of the SVM
+        self.weights = self.features.normalization_.T @ self.svm.coef_.ravel()
+        self.intercept = self.svm.intercept_[0]
+        # Only the Nyström samples are kept for the model cache - the Nystroem
+        # holds a view of a permutation of all the training samples
+        self.components = self.features.components_
+        del self.features, self.svm
+        return self
+
+    def decision_function(self, X):
+        kernel = pairwise_kernels(X, self.components, metric=self.kernel, **self.params)
+        return kernel @ self.weights + self.intercept
+
+
+def compare_to_exact(
+    approximate,
+    X_train,
+    X_test,
+    y_train,
+    y_test,
+    kernel,
+    params,
+    C,
+    shrinking,
+    samples=EXACT_SUBSAMPLE,
+):
+    """Trains the exact SVM on a subsample of the training data, and returns the
+    test accuracy of both on a subsample of the test data. The data is shuffled
+    by train_test_split, so the first samples are a random subsample.
+    """
+    exact = SVC(C=C, kernel=kernel, shrinking=shrinking, **params)
+    exact.fit(X_train[:samples], y_train[:samples])
+
+    X, y = X_test[:samples], y_test[:samples]
+    exact_accuracy = np.mean((exact.decision_function(X) > 0) == y)
+    approximate_accuracy = np.mean(
+        (evaluate_points(approximate.decision_function, X[:, 0], X[:, 1]) > 0) == y
+    )
+    return {
+        "samples": min(samples, len(X_train)),
+        "exact": exact_accuracy,
+        "approximate": approximate_accuracy,
+        "gap": exact_accuracy - approximate_accuracy,
+    }
@@ -3,19 +3,92 @@ import plotly.graph_objs as go
 import numpy as np
 from sklearn import metrics
 
+MAX_POINTS = 2000  # points drawn of each of the training and test data
 
-def serve_prediction_plot(
-    model, X_train, X_test, y_train, y_test, Z, xx, yy, mesh_step, threshold
-):
+
+class EvaluationContext:
+    """What the figures need from a trained model, computed once per model:
+    the decision function on the training and test data, the ROC curve, and
+    the mesh axes and range of the decision function.
+
+    decision is the decision function on np.r_[X_train, X_test], from one call
+    for both instead of one per figure.
+    """
+
+    def __init__(
+        self, decision, X_train, X_test, y_train, y_test, Z, xx, yy, mesh_step
+    ):
+        # Only the first MAX_POINTS are drawn, which is a random sample of
+        # larger datasets since train_test_split shuffles them. The accuracies
+        # and the ROC curve are computed on all of them. Copies, since views
+        # would keep all of the data in the model cache.
+        self.X_train = X_train[:MAX_POINTS].copy()
+        self.X_test = X_test[:MAX_POINTS].copy()
+        self.y_train = y_train[:MAX_POINTS].copy()
+        self.y_test = y_test[:MAX_POINTS].copy()
+
+        decision_train = decision[: len(X_train)]
+        decision_test = decision[len(X_train) :]
+
+        # the decision values of each class, sorted, so the predictions at any
+        # threshold can be counted without going through all of them
+        self.sorted_train = [np.sort(decision_train[y_train == c]) for c in (0, 1)]
+        self.sorted_test = [np.sort(decision_test[y_test == c]) for c in (0, 1)]
+
+        fpr, tpr, _ = metrics.roc_curve(y_test, decision_test)
+        keep = np.linspace(0, len(fpr) - 1, min(len(fpr), MAX_POINTS)).astype(int)
+        self.fpr, self.tpr = fpr[keep], tpr[keep]
+        self.auc_score = metrics.roc_auc_score(y_true=y_test, y_score=decision_test)
+
+        self.x = np.arange(xx.min(), xx.max(), mesh_step)
+        self.y = np.arange(yy.min(), yy.max(), mesh_step)
+        self.Z = Z.reshape(xx.shape)
+        self.z_min = Z.min()
+        self.z_max = Z.max()
+
+    @staticmethod
+    def counts(sorted_by_class, threshold):
+        """tn, fp, fn, tp when predicting 1 above threshold"""
+        negative, positive = sorted_by_class
+        fp = len(negative) - np.searchsorted(negative, threshold, side="right")
+        tp = len(positive) - np.searchsorted(positive, threshold, side="right")
+        return len(negative) - fp, fp, len(positive) - tp, tp
+
+    def accuracy(self, sorted_by_class, threshold):
+        tn, fp, fn, tp = self.counts(sorted_by_class, threshold)
+        return (tn + tp) / (tn + fp + fn + tp)
+
+
+def scale_threshold(context, threshold):
+    """the value of the decision function at a threshold between 0 and 1"""
+    return threshold * (context.z_max - context.z_min) + context.z_min
+
+
+def serve_threshold_line(line, scaled_threshold):
+    # A line rather than a contour of the mesh, so it can come from a finer mesh
+    # and only the line itself is sent to the browser
+    return go.Scatter(
+        # single precision is plenty for drawing, and half the size
+        x=line[0].astype(np.float32),
+        y=line[1].astype(np.float32),
+        mode="lines",
+        hoverinfo="none",
+        showlegend=False,
+        name=f"Threshold ({scaled_threshold:.3f})",
+        line=dict(color="#708090"),
+    )
+
+
+def serve_prediction_plot(context, threshold, line):
     # Get train and test score from model
-    y_pred_train = (model.decision_function(X_train) > threshold).astype(int)
-    y_pred_test = (model.decision_function(X_test) > threshold).astype(int)
-    train_score = metrics.accuracy_score(y_true=y_train, y_pred=y_pred_train)
-    test_score = metrics.accuracy_score(y_true=y_test, y_pred=y_pred_test)
+    train_score = context.accuracy(context.sorted_train, threshold)
+    test_score = context.accuracy(context.sorted_test, threshold)
 
     # Compute threshold
-    scaled_threshold = threshold * (Z.max() - Z.min()) + Z.min()
-    range = max(abs(scaled_threshold - Z.min()), abs(scaled_threshold - Z.max()))
+    scaled_threshold = scale_threshold(context, threshold)
+    range = max(
+        abs(scaled_threshold - context.z_min), abs(scaled_threshold - context.z_max)
+    )
 
     # Colorscale
     bright_cscale = [[0, "#ff3700"], [1, "#0b8bff"]]
@@ -33,9 +106,9 @@ def serve_prediction_plot(
     # Create the plot
     # Plot the prediction contour of the SVM
     trace0 = go.Contour(
-        x=np.arange(xx.min(), xx.max(), mesh_step),
-        y=np.arange(yy.min(), yy.max(), mesh_step),
-        z=Z.reshape(xx.shape),
+        x=context.x,
+        y=context.y,
+        z=context.Z,
         zmin=scaled_threshold - range,
         zmax=scaled_threshold + range,
         hoverinfo="none",
@@ -46,36 +119,28 @@ def serve_prediction_plot(
     )
 
     # Plot the threshold
-    trace1 = go.Contour(
-        x=np.arange(xx.min(), xx.max(), mesh_step),
-        y=np.arange(yy.min(), yy.max(), mesh_step),
-        z=Z.reshape(xx.shape),
-        showscale=False,
-        hoverinfo="none",
-        contours=dict(
-            showlines=False, type="constraint", operation="=", value=scaled_threshold
-        ),
-        name=f"Threshold ({scaled_threshold:.3f})",
-        line=dict(color="#708090"),
-    )
+    trace1 = serve_threshold_line(line, scaled_threshold)
 
     # Plot Training Data
     trace2 = go.Scatter(
-        x=X_train[:, 0],
-        y=X_train[:, 1],
+        x=context.X_train[:, 0],
+        y=context.X_train[:, 1],
         mode="markers",
         name=f"Training Data (accuracy={train_score:.3f})",
-        marker=dict(size=10, color=y_train, colorscale=bright_cscale),
+        marker=dict(size=10, color=context.y_train, colorscale=bright_cscale),
     )
 
     # Plot Test Data
     trace3 = go.Scatter(
-        x=X_test[:, 0],
-        y=X_test[:, 1],
+        x=context.X_test[:, 0],
+        y=context.X_test[:, 1],
         mode="markers",
         name=f"Test Data (accuracy={test_score:.3f})",
         marker=dict(
-            size=10, symbol="triangle-up", color=y_test, colorscale=bright_cscale
+            size=10,
+            symbol="triangle-up",
+            color=context.y_test,
+            colorscale=bright_cscale,
         ),
     )
 
@@ -96,12 +161,9 @@ def serve_prediction_plot(
     return figure
 
 
-def serve_roc_curve(model, X_test, y_test):
-    decision_test = model.decision_function(X_test)
-    fpr, tpr, threshold = metrics.roc_curve(y_test, decision_test)
-
-    # AUC Score
-    auc_score = metrics.roc_auc_score(y_true=y_test, y_score=decision_test)
+def serve_roc_curve(context):
+    # ROC curve and AUC Score
+    fpr, tpr, auc_score = context.fpr, context.tpr, context.auc_score
 
     trace0 = go.Scatter(
         x=fpr, y=tpr, mode="lines", name="Test Data", marker={"color": "#13c6e9"}
@@ -124,13 +186,10 @@ def serve_roc_curve(model, X_test, y_test):
     return figure
 
 
-def serve_pie_confusion_matrix(model, X_test, y_test, Z, threshold):
+def serve_pie_confusion_matrix(context, threshold):
     # Compute threshold
-    scaled_threshold = threshold * (Z.max() - Z.min()) + Z.min()
-    y_pred_test = (model.decision_function(X_test) > scaled_threshold).astype(int)
-
-    matrix = metrics.confusion_matrix(y_true=y_test, y_pred=y_pred_test)
-    tn, fp, fn, tp = matrix.ravel()
+    scaled_threshold = scale_threshold(context, threshold)
+    tn, fp, fn, tp = context.counts(context.sorted_test, scaled_threshold)
 
     values = [tp, fn, fp, tn]
     label_text = ["True Positive", "False Negative", "False Positive", "True Negative"]
@@ -164,3 +223,38 @@ def serve_pie_confusion_matrix(model, X_test, y_test, Z, threshold):
     figure = go.Figure(data=data, layout=layout)
 
     return figure
+
+
+def serve_landscape(C_values, gamma_values, accuracy):
+    # Test accuracy at every position of the C and gamma power sliders, with
+    # gaps for the cells not evaluated yet
+    evaluated = np.count_nonzero(~np.isnan(accuracy))
+    title = "Test Accuracy by C and Gamma"
+    if evaluated < accuracy.size:
+        title += f" ({evaluated} of {accuracy.size})"
+
+    trace0 = go.Heatmap(
+        x=[f"{C:g}" for C in C_values],
+        y=[f"{gamma:g}" for gamma in gamma_values],
+        z=accuracy,
+        zmin=0.5,
+        zmax=1,
+        colorscale=[[0, "#ff744c"], [1, "#13c6e9"]],
+        colorbar=dict(thickness=10),
+        hovertemplate="C: %{x}<br>Gamma: %{y}<br>Accuracy: %{z:.3f}<extra></extra>",
+    )
+
+    layout = go.Layout(
+        title=title,
+        xaxis=dict(title="C", type="category"),
+        yaxis=dict(title="Gamma", type="category"),
+        margin=dict(l=100, r=10, t=25, b=40),
+        plot_bgcolor="#282b38",
+        paper_bgcolor="#282b38",
+        font={"color": "#a5b1cd"},
+    )
+
+    data = [trace0]
+    figure = go.Figure(data=data, layout=layout)
+
+    return figure
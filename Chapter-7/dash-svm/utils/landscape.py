@@ -0,0 +1,108 @@
+import os
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import diskcache
+import numpy as np
+
+from utils.models import CACHE_DIR, get_model, model_key
+
+# the marks of the C and gamma power sliders
+C_POWERS = range(-2, 5)
+GAMMA_POWERS = range(-5, 1)
+
+# Cells are trained on up to LANDSCAPE_WORKERS processes, leaving a core for
+# the models the user asks for
+LANDSCAPE_WORKERS = int(
+    os.environ.get("LANDSCAPE_WORKERS", max(1, min(4, (os.cpu_count() or 1) - 1)))
+)
+
+landscape_store = diskcache.Cache(os.path.join(CACHE_DIR, "landscapes"))
+
+
+def landscape_key(
+    kernel, degree, C_coef, gamma_coef, shrinking, dataset, noise, sample_size
+):
+    """The dataset, which is generated the same way from its parameters every
+    time, and the rest of the parameters of the landscape. As in model_key(),
+    degree and gamma are left out for kernels that ignore them.
+    """
+    return model_key(
+        kernel, degree, C_coef, gamma_coef, shrinking, dataset, noise, sample_size
+    )
+
+
+def axes(C_coef, gamma_coef):
+    """the values of C and gamma of the cells, as update_model() computes them"""
+    C_values = [C_coef * 10**C_power for C_power in C_POWERS]
+    gamma_values = [gamma_coef * 10**gamma_power for gamma_power in GAMMA_POWERS]
+    return C_values, gamma_values
+
+
+def cell_accuracy(params):
+    """trains the model of a cell, which puts it in the model store, and
+    returns its test accuracy
+    """
+    context = get_model(**params)["context"]
+    return context.accuracy(context.sorted_test, 0)
+
+
+def compute_landscape(
+    kernel,
+    degree,
+    C_coef,
+    gamma_coef,
+    shrinking,
+    dataset,
+    noise,
+    sample_size,
+    on_cell=None,
+    workers=LANDSCAPE_WORKERS,
+):
+    """The test accuracy of the model at every position of the C and gamma power
+    sliders, with a row for each gamma, from the landscape store if it has it.
+
+    The models are trained on a process pool, and on_cell(accuracy) is called
+    with the cells finished so far, NaN for the others, as each one finishes.
+    The models go in the model store, so moving the sliders to any of the
+    cells afterwards loads its model instead of training it.
+    """
+    key = landscape_key(
+        kernel, degree, C_coef, gamma_coef, shrinking, dataset, noise, sample_size
+    )
+    accuracy = landscape_store.get(key)
+    if accuracy is not None:
+        return accuracy
+
+    # the cells of each model - all the gammas of a row share one when the
+    # kernel ignores gamma
+    cells = defaultdict(list)
+    C_values, gamma_values = axes(C_coef, gamma_coef)
+    for i, gamma in enumerate(gamma_values):
+        for j, C in enumerate(C_values):
+            params = dict(
+                kernel=kernel,
+                degree=degree,
+                C=C,
+                gamma=gamma,
+                shrinking=shrinking,
+                dataset=dataset,
+                noise=noise,
+                sample_size=sample_size,
+            )
+            cells[model_key(**params)].append((i, j, params))
+
+    accuracy = np.full((len(gamma_values), len(C_values)), np.nan)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(cell_accuracy, same_model[0][2]): same_model
+            for same_model in cells.values()
+        }
+        for future in as_completed(futures):
+            for i, j, _ in futures[future]:
+                accuracy[i, j] = future.result()
+            if on_cell is not None:
+                on_cell(accuracy)
+
+    landscape_store.set(key, accuracy)
+    return accuracy
@@ -0,0 +1,231 @@
+import os
+import threading
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+REFINE = 4  # fine mesh points per step of the coarse mesh
+STEEP = 0.2  # a coarse cell is steep if it spans this much of the range of Z
+
+# The decision function is evaluated CHUNK_SIZE points at a time on up to
+# MESH_WORKERS threads. libsvm releases the GIL while it predicts, so the
+# threads run on separate cores and write straight into one output array.
+CHUNK_SIZE = 10000
+MESH_WORKERS = int(os.environ.get("MESH_WORKERS", min(4, os.cpu_count() or 1)))
+
+
+def run_chunks(evaluate, starts, workers):
+    """calls evaluate(start) for every start, on a thread pool if it's worth it"""
+    if workers <= 1 or len(starts) <= 1:
+        for start in starts:
+            evaluate(start)
+        return
+    with ThreadPoolExecutor(max_workers=min(workers, len(starts))) as executor:
+        # list() so an exception in any chunk is raised here
+        list(executor.map(evaluate, starts))
+
+
+def evaluate_points(
+    decision_function, x, y, out=None, chunk_size=CHUNK_SIZE, workers=MESH_WORKERS
+):
+    """the decision function at the points (x[i], y[i]), written into out"""
+    if out is None:
+        out = np.empty(len(x))
+
+    def evaluate(start):
+        stop = start + chunk_size
+        out[start:stop] = decision_function(np.c_[x[start:stop], y[start:stop]])
+
+    run_chunks(evaluate, range(0, len(x), chunk_size), workers)
+    return out
+
+
+def upsample(Z, refine):
+    """bilinear interpolation of Z onto a mesh `refine` times finer"""
+
+    def along(Z, axis):
+        n = Z.shape[axis]
+        t = np.arange((n - 1) * refine + 1) / refine
+        i = np.minimum(t.astype(int), n - 2)
+        f = t - i
+        lo, hi = np.take(Z, i, axis=axis), np.take(Z, i + 1, axis=axis)
+        f = f if axis == 1 else f[:, None]
+        return lo * (1 - f) + hi * f
+
+    return along(along(Z, 1), 0)
+
+
+def join_segments(starts, ends):
+    """joins segments that share end points into lines, returned as x and y with
+    NaN between the lines so they can be drawn as one trace
+    """
+    starts = list(zip(*starts))
+    ends = list(zip(*ends))
+    segments_at = defaultdict(list)
+    for k, (start, end) in enumerate(zip(starts, ends)):
+        segments_at[start].append(k)
+        segments_at[end].append(k)
+
+    used = np.zeros(len(starts), dtype=bool)
+    points = []
+    for k in range(len(starts)):
+        if used[k]:
+            continue
+        used[k] = True
+        line = deque([starts[k], ends[k]])
+        # follow the line from both ends of the segment
+        for forward in (True, False):
+            point = line[-1] if forward else line[0]
+            while True:
+                following = [m for m in segments_at[point] if not used[m]]
+                if not following:
+                    break
+                m = following[0]
+                used[m] = True
+                point = ends[m] if starts[m] == point else starts[m]
+                if forward:
+                    line.append(point)
+                else:
+                    line.appendleft(point)
+        points += list(line) + [(np.nan, np.nan)]
+
+    if not points:
+        return np.array([]), np.array([])
+    x, y = np.array(points[:-1]).T
+    return x, y
+
+
+def contour_lines(x, y, Z, level):
+    """Marching squares. Returns the x and y of the lines where Z crosses level,
+    with NaN between the lines.
+    """
+    # a mesh point exactly on the level would be a crossing shared by every
+    # edge around it - nudge it up, so crossings are always inside an edge
+    Z = np.where(Z == level, np.nextafter(level, np.inf), Z)
+    a, b = Z[:-1, :-1], Z[:-1, 1:]  # corners at the bottom of each cell
+    d, c = Z[1:, :-1], Z[1:, 1:]  # and at the top
+    x0, x1 = x[:-1][None, :], x[1:][None, :]
+    y0, y1 = y[:-1][:, None], y[1:][:, None]
+
+    def crossing(z0, z1, p0, p1):
+        with np.errstate(divide="ignore", invalid="ignore"):
+            t = (level - z0) / (z1 - z0)
+        return np.where((z0 > level) != (z1 > level), p0 + t * (p1 - p0), np.nan)
+
+    shape = a.shape
+    # crossings on the bottom, right, top and left edges of every cell
+    ex = np.stack(
+        [
+            crossing(a, b, x0, x1),
+            np.broadcast_to(np.where((b > level) != (c > level), x1, np.nan), shape),
+            crossing(d, c, x0, x1),
+            np.broadcast_to(np.where((a > level) != (d > level), x0, np.nan), shape),
+        ]
+    )
+    ey = np.stack(
+        [
+            np.broadcast_to(np.where((a > level) != (b > level), y0, np.nan), shape),
+            crossing(b, c, y0, y1),
+            np.broadcast_to(np.where((d > level) != (c > level), y1, np.nan), shape),
+            crossing(a, d, y0, y1),
+        ]
+    )
+    crosses = ~np.isnan(ex)
+    count = crosses.sum(axis=0)
+
+    # cells crossed twice have one segment between their two crossings
+    rows, cols = np.nonzero(count == 2)
+    edges = np.argsort(~crosses[:, rows, cols], axis=0, kind="stable")[:2]
+    starts = ex[edges[0], rows, cols], ey[edges[0], rows, cols]
+    ends = ex[edges[1], rows, cols], ey[edges[1], rows, cols]
+
+    # saddles are crossed four times - the middle of the cell decides which
+    # pairs of crossings are joined
+    rows, cols = np.nonzero(count == 4)
+    middle = (a + b + c + d)[rows, cols] / 4
+    bottom_left = (middle > level) == (b[rows, cols] > level)
+    first = np.where(bottom_left, 3, 1)  # joined to the bottom edge
+    second = np.where(bottom_left, 1, 3)  # joined to the top edge
+    starts = [
+        np.r_[s, e[0, rows, cols], e[2, rows, cols]] for s, e in zip(starts, (ex, ey))
+    ]
+    ends = [
+        np.r_[s, e[first, rows, cols], e[second, rows, cols]]
+        for s, e in zip(ends, (ex, ey))
+    ]
+
+    return join_segments(starts, ends)
+
+
+class AdaptiveMesh:
+    """The decision function on a mesh REFINE times finer than the coarse mesh,
+    evaluated only in the coarse cells that need it: where the surface is steep,
+    and where a threshold line crosses. Everywhere else the fine mesh is
+    interpolated from the coarse one.
+
+    The fine values are kept with the model in the model cache, so moving the
+    threshold only evaluates cells the line hasn't crossed before.
+    """
+
+    def __init__(self, decision_function, x, y, Z, refine=REFINE):
+        self.decision_function = decision_function
+        self.refine = refine
+        self.Z = Z
+        self.fine_x = x[0] + (x[1] - x[0]) / refine * np.arange(
+            (len(x) - 1) * refine + 1
+        )
+        self.fine_y = y[0] + (y[1] - y[0]) / refine * np.arange(
+            (len(y) - 1) * refine + 1
+        )
+        self.fine_Z = upsample(Z, refine)
+        self.refined = np.zeros((len(y) - 1, len(x) - 1), dtype=bool)
+        # fine mesh points that hold the decision function, not an interpolation
+        self.exact = np.zeros(self.fine_Z.shape, dtype=bool)
+        self.exact[::refine, ::refine] = True
+        self.evaluated = Z.size
+        self.lock = threading.Lock()
+
+        corners = np.stack([Z[:-1, :-1], Z[:-1, 1:], Z[1:, :-1], Z[1:, 1:]])
+        self.cell_min = corners.min(axis=0)
+        self.cell_max = corners.max(axis=0)
+        self.refine_cells(self.cell_max - self.cell_min > STEEP * np.ptp(Z))
+
+    def __getstate__(self):
+        # locks can't be pickled, for the model store
+        state = self.__dict__.copy()
+        del state["lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    def refine_cells(self, cells):
+        """evaluates the fine mesh inside the coarse cells not refined yet"""
+        cells = cells & ~self.refined
+        if not cells.any():
+            return
+        r = self.refine
+        points = np.zeros(self.fine_Z.shape, dtype=bool)
+        for i, j in np.argwhere(cells):
+            points[i * r : (i + 1) * r + 1, j * r : (j + 1) * r + 1] = True
+        rows, cols = np.nonzero(points & ~self.exact)
+        self.fine_Z[rows, cols] = evaluate_points(
+            self.decision_function, self.fine_x[cols], self.fine_y[rows]
+        )
+        self.exact[rows, cols] = True
+        self.refined |= cells
+        self.evaluated += len(rows)
+
+    def threshold_line(self, level, fine=True):
+        """the line where the decision function equals level. With fine=False
+        it is traced on the coarse mesh only, which needs no evaluations.
+        """
+        if not fine:
+            x = self.fine_x[:: self.refine]
+            y = self.fine_y[:: self.refine]
+            return contour_lines(x, y, self.Z, level)
+        with self.lock:
+            self.refine_cells((self.cell_min <= level) & (level <= self.cell_max))
+            return contour_lines(self.fine_x, self.fine_y, self.fine_Z, level)
@@ -0,0 +1,294 @@
+import hashlib
+import os
+import pickle
+import threading
+from collections import OrderedDict
+from functools import partial
+
+import diskcache
+import numpy as np
+from sklearn import datasets
+from sklearn.metrics.pairwise import pairwise_kernels
+from sklearn.model_selection import train_test_split
+from sklearn.preprocessing import StandardScaler
+from sklearn.svm import SVC
+
+from utils.approximate import ApproximateSVM, compare_to_exact
+from utils.figures import EvaluationContext
+from utils.mesh import AdaptiveMesh, evaluate_points
+
+MESH_STEP = 0.3  # step size in the mesh
+APPROXIMATE_ABOVE = 5000  # samples above which the SVM is approximated
+CACHE_DIR = "cache"  # trained models and background jobs, shared by the workers
+
+
+def generate_data(n_samples, dataset, noise):
+    if dataset == "moons":
+        return datasets.make_moons(n_samples=n_samples, noise=noise, random_state=0)
+
+    elif dataset == "circles":
+        return datasets.make_circles(
+            n_samples=n_samples, noise=noise, factor=0.5, random_state=1
+        )
+
+    elif dataset == "linear":
+        X, y = datasets.make_classification(
+            n_samples=n_samples,
+            n_features=2,
+            n_redundant=0,
+            n_informative=2,
+            random_state=2,
+            n_clusters_per_class=1,
+        )
+
+        rng = np.random.RandomState(2)
+        X += noise * rng.uniform(size=X.shape)
+        linearly_separable = (X, y)
+
+        return linearly_separable
+
+    else:
+        raise ValueError(
+            "Data type incorrectly specified. Please choose an existing dataset."
+        )
+
+
+def kernel_params(kernel, degree, gamma):
+    """the parameters of the kernel function, as SVC uses them with coef0=0"""
+    if kernel == "linear":
+        return {}
+    if kernel == "poly":
+        return {"degree": degree, "gamma": gamma, "coef0": 0}
+    if kernel == "sigmoid":
+        return {"gamma": gamma, "coef0": 0}
+    return {"gamma": gamma}
+
+
+def fingerprint(*arrays):
+    """a short hash of the contents of the arrays"""
+    digest = hashlib.sha1()
+    for array in arrays:
+        digest.update(np.ascontiguousarray(array).tobytes())
+    return digest.hexdigest()
+
+
+def kernel_key(X_train, X_test, kernel, degree, gamma):
+    """The data and the kernel function. C and shrinking aren't part of it, so
+    the kernel matrices of the same data are reused as C changes.
+    """
+    params = kernel_params(kernel, degree, gamma)
+    return (fingerprint(X_train, X_test), kernel, tuple(sorted(params.items())))
+
+
+def compute_kernels(X_train, X_test, kernel, degree, gamma):
+    """The kernel function between the training data and itself, and the test
+    data - what SVC(kernel="precomputed") needs to be trained and to evaluate
+    the training and test data. The mesh is evaluated in chunks instead, by
+    kernel_decision_function().
+    """
+    params = kernel_params(kernel, degree, gamma)
+    return {
+        "train": pairwise_kernels(X_train, X_train, metric=kernel, **params),
+        "test": pairwise_kernels(X_test, X_train, metric=kernel, **params),
+    }
+
+
+def kernel_decision_function(clf, X_train, kernel, params, points):
+    """the decision function of a precomputed SVM at points that aren't in the
+    kernel cache, like the mesh
+    """
+    return clf.decision_function(
+        pairwise_kernels(points, X_train, metric=kernel, **params)
+    )
+
+
+def train_model(kernel, degree, C, gamma, shrinking, dataset, noise, sample_size):
+    """Generates the dataset, trains the SVM and evaluates its decision function
+    on a mesh covering the data. Returns only what the figures need, since it
+    is kept in the model cache and the model store.
+
+    The SVM is trained on precomputed kernel matrices from the kernel store, so
+    changing C only solves the SVM again, without computing the kernel. Above
+    APPROXIMATE_ABOVE samples an ApproximateSVM is trained instead, and its
+    accuracy is compared to the exact SVM on a subsample.
+    """
+    # Data Pre-processing
+    X, y = generate_data(n_samples=sample_size, dataset=dataset, noise=noise)
+    X = StandardScaler().fit_transform(X)
+    X_train, X_test, y_train, y_test = train_test_split(
+        X, y, test_size=0.4, random_state=42
+    )
+
+    x_min = X[:, 0].min() - 0.5
+    x_max = X[:, 0].max() + 0.5
+    y_min = X[:, 1].min() - 0.5
+    y_max = X[:, 1].max() + 0.5
+    x = np.arange(x_min, x_max, MESH_STEP)
+    y = np.arange(y_min, y_max, MESH_STEP)
+    xx, yy = np.meshgrid(x, y)
+
+    params = kernel_params(kernel, degree, gamma)
+    if sample_size > APPROXIMATE_ABOVE:
+        # Train SVM
+        clf = ApproximateSVM(kernel, params, C).fit(X_train, y_train)
+        decision_function = clf.decision_function
+
+        # Plot the decision boundary. For that, we will assign a color to each
+        # point in the mesh [x_min, x_max]x[y_min, y_max].
+        Z = evaluate_points(decision_function, xx.ravel(), yy.ravel())
+        decision = evaluate_points(decision_function, *np.r_[X_train, X_test].T)
+        approximation = compare_to_exact(
+            clf, X_train, X_test, y_train, y_test, kernel, params, C, shrinking
+        )
+    else:
+        kernels = get_kernels(X_train, X_test, kernel, degree, gamma)
+
+        # Train SVM
+        clf = SVC(C=C, kernel="precomputed", shrinking=shrinking)
+        clf.fit(kernels["train"], y_train)
+
+        # a partial rather than a closure, so the model can go in the model store
+        decision_function = partial(
+            kernel_decision_function, clf, X_train, kernel, params
+        )
+
+        # Plot the decision boundary. For that, we will assign a color to each
+        # point in the mesh [x_min, x_max]x[y_min, y_max].
+        Z = evaluate_points(decision_function, xx.ravel(), yy.ravel())
+        decision = clf.decision_function(np.r_[kernels["train"], kernels["test"]])
+        approximation = None
+
+    return {
+        # the model evaluated once for all the figures
+        "context": EvaluationContext(
+            decision,
+            X_train,
+            X_test,
+            y_train,
+            y_test,
+            Z,
+            xx,
+            yy,
+            MESH_STEP,
+        ),
+        # a finer mesh for the threshold line, refined as the line moves
+        "mesh": AdaptiveMesh(decision_function, x, y, Z.reshape(xx.shape)),
+        # the accuracy of an ApproximateSVM against the exact SVM
+        "approximation": approximation,
+    }
+
+
+def model_key(kernel, degree, C, gamma, shrinking, dataset, noise, sample_size):
+    """The parameters that change the trained model. Degree and gamma are left
+    out for kernels that ignore them, so moving a disabled slider doesn't retrain.
+    """
+    if kernel != "poly":
+        degree = None
+    if kernel == "linear":
+        gamma = None
+    return (kernel, degree, C, gamma, shrinking, dataset, noise, sample_size)
+
+
+def entry_size(trained):
+    """the bytes of a trained model, as the model store pickles it"""
+    return len(pickle.dumps(trained, protocol=pickle.HIGHEST_PROTOCOL))
+
+
+class ModelCache:
+    """Least recently used cache of trained models and their mesh evaluations.
+
+    The threshold slider only changes how the decision function is drawn, so
+    moving it, or going back to parameters tried before, reuses the model.
+    Each gunicorn worker has its own cache, of at most maxsize models and
+    maxbytes bytes - a model of a million samples takes about 8 MB.
+    """
+
+    def __init__(self, maxsize=32, maxbytes=2**26):
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self.models = OrderedDict()
+        self.sizes = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, make_model):
+        """returns the cached model for key, or calls make_model() and caches it"""
+        with self.lock:
+            if key in self.models:
+                self.hits += 1
+                self.models.move_to_end(key)
+                return self.models[key]
+            self.misses += 1
+
+        trained = make_model()
+        size = entry_size(trained)
+
+        with self.lock:
+            self.models[key] = trained
+            self.sizes[key] = size
+            self.models.move_to_end(key)
+            # the newest model is kept even if it alone is over maxbytes
+            while len(self.models) > 1 and (
+                len(self.models) > self.maxsize
+                or sum(self.sizes.values()) > self.maxbytes
+            ):
+                oldest, _ = self.models.popitem(last=False)
+                del self.sizes[oldest]
+                self.evictions += 1
+        return trained
+
+    def stats(self):
+        return {
+            "size": len(self.models),
+            "maxsize": self.maxsize,
+            "bytes": sum(self.sizes.values()),
+            "maxbytes": self.maxbytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+model_cache = ModelCache()
+# Models trained by any worker or background job are pickled to disk, so the
+# others load them instead of training them again. Big enough for the models of
+# a whole landscape of a million samples
+model_store = diskcache.Cache(os.path.join(CACHE_DIR, "models"), size_limit=2**30)
+# The kernel matrices too, since each model is trained in a new job process.
+# A few hundred samples make kernel matrices of at most a few MB each
+kernel_store = diskcache.Cache(
+    os.path.join(CACHE_DIR, "kernels"), size_limit=2**28, statistics=True
+)
+
+
+def get_kernels(X_train, X_test, kernel, degree, gamma):
+    """returns compute_kernels() for this data and kernel, computed at most once"""
+    key = kernel_key(X_train, X_test, kernel, degree, gamma)
+    kernels = kernel_store.get(key)
+    if kernels is None:
+        kernels = compute_kernels(X_train, X_test, kernel, degree, gamma)
+        kernel_store.set(key, kernels)
+    return kernels
+
+
+def load_or_train(key, params):
+    trained = model_store.get(key)
+    if trained is None:
+        trained = train_model(*params)
+        model_store.set(key, trained)
+    return trained
+
+
+def get_model(kernel, degree, C, gamma, shrinking, dataset, noise, sample_size):
+    """returns train_model() for these parameters, trained at most once"""
+    params = (kernel, degree, C, gamma, shrinking, dataset, noise, sample_size)
+    key = model_key(*params)
+    return model_cache.get(key, lambda: load_or_train(key, params))
+
+
+def is_trained(kernel, degree, C, gamma, shrinking, dataset, noise, sample_size):
+    """True if get_model() would find the model without training it"""
+    key = model_key(kernel, degree, C, gamma, shrinking, dataset, noise, sample_size)
+    return key in model_cache.models or key in model_store